@@ -8,6 +8,13 @@
 """
 
 from .lookupy import Collection, Q
+from .sources import JsonSource, JsonlSource, ChunkedSource
+from .aggregates import Count, Sum, Min, Max, Avg, ApproxCountDistinct, \
+    ApproxQuantiles, Sample
+from .live import LiveCollection
+from .expressions import F, Value
 
-__all__ = ["Collection", "Q"]
+__all__ = ["Collection", "Q", "JsonSource", "JsonlSource", "ChunkedSource",
+           "Count", "Sum", "Min", "Max", "Avg", "ApproxCountDistinct",
+           "ApproxQuantiles", "Sample", "LiveCollection", "F", "Value"]
 
@@ -0,0 +1,226 @@
+"""
+   lookupy.aggregates
+   ~~~~~~~~~~~~~~~~~~
+
+   This module consists of aggregates that can be computed over a
+   QuerySet eg::
+
+       >>> c.filter(response__status=200).aggregate(n=Count(),
+       ...                                          wait=Avg('timings__wait'))
+       {'n': 42, 'wait': 61.5}
+
+   Aggregates are computed incrementally, one item at a time, and
+   aggregates of the same kind computed separately (eg. over different
+   partitions of the data) can be merged.
+
+"""
+
+import copy
+
+from .dunderkey import dunder_get
+from .sketches import HyperLogLog, QuantileSketch, ReservoirSample
+
+
+class Aggregate(object):
+    """Base class for all aggregates
+
+    Items for which the field is missing (or None) are ignored.
+
+    :param field : (str) dunder key of the field to aggregate
+
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.reset()
+
+    def reset(self):
+        raise NotImplementedError
+
+    def add(self, item):
+        """Adds an item to the aggregate"""
+        value = dunder_get(item, self.field)
+        if value is not None:
+            self.add_value(value)
+
+    def add_value(self, value):
+        raise NotImplementedError
+
+    def merge(self, other):
+        """Merges another aggregate of the same kind into this one"""
+        raise NotImplementedError
+
+    @property
+    def value(self):
+        raise NotImplementedError
+
+    def copy(self):
+        """Returns a new aggregate of the same kind with nothing added"""
+        agg = copy.copy(self)
+        agg.reset()
+        return agg
+
+
+class Count(Aggregate):
+    """Counts the items, or only the ones having the field if given"""
+
+    def __init__(self, field=None):
+        super(Count, self).__init__(field)
+
+    def reset(self):
+        self.count = 0
+
+    def add(self, item):
+        if self.field is None or dunder_get(item, self.field) is not None:
+            self.count += 1
+
+    def merge(self, other):
+        self.count += other.count
+
+    @property
+    def value(self):
+        return self.count
+
+
+class Sum(Aggregate):
+
+    def reset(self):
+        self.total = 0
+
+    def add_value(self, value):
+        self.total += value
+
+    def merge(self, other):
+        self.total += other.total
+
+    @property
+    def value(self):
+        return self.total
+
+
+class Min(Aggregate):
+
+    def reset(self):
+        self.min = None
+
+    def add_value(self, value):
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def merge(self, other):
+        if other.min is not None:
+            self.add_value(other.min)
+
+    @property
+    def value(self):
+        return self.min
+
+
+class Max(Aggregate):
+
+    def reset(self):
+        self.max = None
+
+    def add_value(self, value):
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if other.max is not None:
+            self.add_value(other.max)
+
+    @property
+    def value(self):
+        return self.max
+
+
+class Avg(Aggregate):
+
+    def reset(self):
+        self.total = 0
+        self.count = 0
+
+    def add_value(self, value):
+        self.total += value
+        self.count += 1
+
+    def merge(self, other):
+        self.total += other.total
+        self.count += other.count
+
+    @property
+    def value(self):
+        return self.total / float(self.count) if self.count else None
+
+
+## Approximate aggregates, computed in bounded memory using sketches
+
+class ApproxCountDistinct(Aggregate):
+    """Estimates the number of distinct values (see ``HyperLogLog``)"""
+
+    def __init__(self, field, precision=14):
+        self.precision = precision
+        super(ApproxCountDistinct, self).__init__(field)
+
+    def reset(self):
+        self.sketch = HyperLogLog(self.precision)
+
+    def add_value(self, value):
+        self.sketch.add(value)
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+
+    @property
+    def value(self):
+        return self.sketch.count()
+
+
+class ApproxQuantiles(Aggregate):
+    """Estimates the values at quantiles (see ``QuantileSketch``)
+
+        >>> c.aggregate(wait=ApproxQuantiles('timings__wait', [0.5, 0.99]))
+        {'wait': [45, 1210]}
+
+    """
+
+    def __init__(self, field, quantiles, k=200, seed=None):
+        self.quantiles = list(quantiles)
+        self.k = k
+        self.seed = seed
+        super(ApproxQuantiles, self).__init__(field)
+
+    def reset(self):
+        self.sketch = QuantileSketch(self.k, self.seed)
+
+    def add_value(self, value):
+        self.sketch.add(value)
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+
+    @property
+    def value(self):
+        return self.sketch.quantiles(self.quantiles)
+
+
+class Sample(Aggregate):
+    """Uniform random sample of the items (see ``ReservoirSample``)"""
+
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.seed = seed
+        super(Sample, self).__init__(None)
+
+    def reset(self):
+        self.sketch = ReservoirSample(self.size, self.seed)
+
+    def add(self, item):
+        self.sketch.add(item)
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+
+    @property
+    def value(self):
+        return self.sketch.values
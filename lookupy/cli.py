@@ -0,0 +1,347 @@
+"""
+   lookupy.cli
+   ~~~~~~~~~~~
+
+   This module implements the ``lookupy`` command that filters items in
+   json, jsonl and HAR files (optionally compressed) and writes the
+   results as json lines eg::
+
+       $ lookupy -f 'response__status__gte=500 | timings__wait__gt=1000' \\
+                 -s request__url -s response__status -j 4 --stats *.har.gz
+
+   Filter expressions consist of lookups (``field__lookuptype=value``)
+   combined using ``&`` (and), ``|`` (or), ``~`` (not) and parentheses.
+   Values are parsed as json if possible (eg. ``200``, ``null``,
+   ``"quoted string"``, ``[400, 404]``) and taken as strings
+   otherwise, except that the values of lookups on strings (eg.
+   ``request__url__contains=404``) are always taken as strings. Multiple
+   filter expressions are and-ed together.
+
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from multiprocessing import Pool
+
+from .lookupy import Collection, Q, LookupyError
+from .dunderkey import dunder_partition
+from .sources import JsonSource, JsonlSource
+
+
+# lookups, operators and parens in a filter expression. Values
+# containing whitespace, parens or operators need to be quoted
+_token = re.compile(r"""\s*(?:(?P<op>[()&|~])|
+                            (?P<key>\w+)\s*=\s*(?P<value>"(?:[^"\\]|\\.)*"|\[[^\]]*\]|[^\s()&|]+))""",
+                    re.VERBOSE)
+
+
+def tokenize(expr):
+    """Splits a filter expression into tokens
+
+    :param expr : (str) filter expression
+    :rtype      : (list) of operators (str) and lookups (2 tuples of
+                  key and value)
+
+    """
+    tokens, pos = [], 0
+    expr = expr.rstrip()
+    while pos < len(expr):
+        m = _token.match(expr, pos)
+        if m is None:
+            raise LookupyError('Invalid filter expression at: {rest}'.format(rest=expr[pos:].strip()))
+        if m.group('op'):
+            tokens.append(m.group('op'))
+        else:
+            key = m.group('key')
+            tokens.append((key, parse_value(m.group('value'), dunder_partition(key)[1])))
+        pos = m.end()
+    return tokens
+
+
+# lookup types the values of which are strings
+STRING_LOOKUPS = ('contains', 'icontains', 'startswith', 'istartswith',
+                  'endswith', 'iendswith', 'regex')
+
+
+def parse_value(value, lookup=None):
+    """Parses the value of a lookup in a filter expression
+
+    :param value  : (str) value as in the expression
+    :param lookup : (str) lookup type or the last part of the key
+    :rtype        : (mixed)
+
+    """
+    if lookup in STRING_LOOKUPS and not value.startswith('"'):
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def parse_filter(expr):
+    """Parses a filter expression into a ``Q`` object
+
+        >>> parse_filter('response__status=200 & ~request__method=GET')
+
+    ``~`` binds tighter than ``&`` which binds tighter than ``|``.
+
+    :param expr : (str) filter expression
+    :rtype      : ``Q`` object
+
+    """
+    tokens = tokenize(expr)
+    pos = [0]
+
+    def peek():
+        return tokens[pos[0]] if pos[0] < len(tokens) else None
+
+    def take():
+        token = peek()
+        if token is None:
+            raise LookupyError('Unexpected end of filter expression')
+        pos[0] += 1
+        return token
+
+    def parse_or():
+        result = parse_and()
+        while peek() == '|':
+            take()
+            result = result | parse_and()
+        return result
+
+    def parse_and():
+        result = parse_not()
+        while peek() == '&':
+            take()
+            result = result & parse_not()
+        return result
+
+    def parse_not():
+        token = take()
+        if token == '~':
+            return ~parse_not()
+        if token == '(':
+            result = parse_or()
+            if take() != ')':
+                raise LookupyError('Expected ) in filter expression')
+            return result
+        if isinstance(token, tuple):
+            key, value = token
+            return Q(**{key: value})
+        raise LookupyError('Unexpected {token} in filter expression'.format(token=token))
+
+    result = parse_or()
+    if peek() is not None:
+        raise LookupyError('Unexpected {token} in filter expression'.format(token=peek()))
+    return result
+
+
+COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.xz')
+JSONL_EXTENSIONS = ('.jsonl', '.ndjson')
+EXTENSIONS = ('.json', '.har') + JSONL_EXTENSIONS
+
+
+def open_source(path, key=None):
+    """Returns the source for a file based on its extension
+
+    Files named ``*.jsonl`` or ``*.ndjson`` (optionally followed by a
+    compression extension) are read line by line and all others as a
+    single json document.
+
+    """
+    name = path
+    for ext in COMPRESSED_EXTENSIONS:
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    if name.endswith(JSONL_EXTENSIONS):
+        return JsonlSource(path)
+    return JsonSource(path, key=key)
+
+
+def expand_paths(paths):
+    """Replaces directories with the json files in them"""
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                base = name
+                for ext in COMPRESSED_EXTENSIONS:
+                    if base.endswith(ext):
+                        base = base[:-len(ext)]
+                if base.endswith(EXTENSIONS):
+                    result.append(os.path.join(path, name))
+        else:
+            result.append(path)
+    return result
+
+
+class CountingSource(object):
+    """Counts the items read from a source"""
+
+    def __init__(self, source):
+        self.source = source
+        self.count = 0
+
+    def __iter__(self):
+        for item in self.source:
+            self.count += 1
+            yield item
+
+    def candidates(self, lookup_groups):
+        for item in self.source.candidates(lookup_groups):
+            self.count += 1
+            yield item
+
+
+def query_file(path, fileobj, filters=(), fields=(), flatten=False, key=None):
+    """Writes the results of the query over a file as json lines
+
+    :param path    : path of the file to query
+    :param fileobj : file object to write the results to
+    :param filters : (list) of filter expressions
+    :param fields  : (list) dunder keys of the fields to select
+    :param flatten : (boolean) whether to truncate the selected keys
+    :param key     : (str) dunder key of the items in json files
+    :rtype         : (dict) stats about the file
+
+    """
+    source = CountingSource(open_source(path, key))
+    qs = Collection(source)
+    if filters:
+        qs = qs.filter(*[parse_filter(f) for f in filters])
+    if fields:
+        qs = qs.select(*fields, flatten=flatten)
+    matches = qs.to_jsonl(fileobj)
+    return {'files': 1,
+            'records': source.count,
+            'matches': matches,
+            'bytes': os.path.getsize(path)}
+
+
+def _query_file_to(args):
+    # runs in the worker processes, writing the results to a temporary
+    # file rather than sending them back to the main process
+    path, outpath, kwargs = args
+    with open(outpath, 'w') as f:
+        stats = query_file(path, f, **kwargs)
+    return outpath, stats
+
+
+def query_files(paths, fileobj, jobs=1, **kwargs):
+    """Writes the results of the query over many files as json lines
+
+    With more than one job, the files are queried in a pool of
+    processes. The results are still written in the order of the files.
+
+    :param paths   : (list) of paths of the files
+    :param fileobj : file object to write the results to
+    :param jobs    : (int) number of processes
+    :param kwargs  : see ``query_file``
+    :rtype         : (dict) stats about all the files
+
+    """
+    totals = {'files': 0, 'records': 0, 'matches': 0, 'bytes': 0}
+    def add(stats):
+        for k, v in stats.items():
+            totals[k] += v
+
+    if jobs <= 1 or len(paths) <= 1:
+        for path in paths:
+            add(query_file(path, fileobj, **kwargs))
+        return totals
+
+    tmpdir = tempfile.mkdtemp(prefix='lookupy-')
+    try:
+        tasks = [(path, os.path.join(tmpdir, '{i}.jsonl'.format(i=i)), kwargs)
+                 for i, path in enumerate(paths)]
+        with Pool(min(jobs, len(paths))) as pool:
+            for outpath, stats in pool.imap(_query_file_to, tasks):
+                with open(outpath) as f:
+                    shutil.copyfileobj(f, fileobj)
+                os.remove(outpath)
+                add(stats)
+    finally:
+        shutil.rmtree(tmpdir)
+    return totals
+
+
+def format_stats(stats, elapsed):
+    rate = stats['records'] / elapsed if elapsed else 0
+    throughput = stats['bytes'] / elapsed / (1 << 20) if elapsed else 0
+    return ('files: {files}, records: {records}, matches: {matches}, '
+            'bytes: {bytes}, elapsed: {elapsed:.3f}s, '
+            '{rate:.0f} records/s, {throughput:.1f} MB/s').format(elapsed=elapsed,
+                                                                  rate=rate,
+                                                                  throughput=throughput,
+                                                                  **stats)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog='lookupy',
+        description='Filter items in json, jsonl and HAR files and write them as json lines')
+    parser.add_argument('paths', nargs='+', metavar='FILE',
+                        help='json, jsonl or HAR file (optionally gzip, bz2 or xz '
+                             'compressed) or a directory of them')
+    parser.add_argument('-f', '--filter', action='append', default=[], dest='filters',
+                        metavar='EXPR',
+                        help='filter expression eg. "response__status__gte=400 & '
+                             '~request__method=GET", may be repeated')
+    parser.add_argument('-s', '--select', action='append', default=[], dest='fields',
+                        metavar='FIELDS',
+                        help='comma separated dunder keys of the fields to output, '
+                             'may be repeated')
+    parser.add_argument('--flatten', action='store_true',
+                        help='output selected fields with just the last part of their keys')
+    parser.add_argument('-k', '--key', default=None,
+                        help='dunder key of the list of items in json files '
+                             '(default: the document if it is a list or the HAR entries)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes to query files in (default: 1)')
+    parser.add_argument('--stats', action='store_true',
+                        help='print the number of records read and matched and the '
+                             'throughput to stderr')
+    return parser
+
+
+def main(argv=None):
+    """Entry point of the ``lookupy`` command
+
+    :param argv : (list) command line arguments, defaults to
+                  ``sys.argv[1:]``
+    :rtype      : (int) exit status
+
+    """
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    fields = [f for fs in args.fields for f in fs.split(',') if f]
+    try:
+        # invalid filters are reported before reading any files
+        for f in args.filters:
+            parse_filter(f)
+    except LookupyError as e:
+        parser.error(str(e))
+
+    start = time.time()
+    try:
+        stats = query_files(expand_paths(args.paths), sys.stdout, jobs=args.jobs,
+                            filters=args.filters, fields=fields,
+                            flatten=args.flatten, key=args.key)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # eg. when piped to head, which is fine
+        sys.stdout = open(os.devnull, 'w')
+        return 0
+    except (LookupyError, OSError, ValueError, TypeError) as e:
+        sys.stderr.write('lookupy: error: {e}\n'.format(e=e))
+        return 1
+    if args.stats:
+        sys.stderr.write(format_stats(stats, time.time() - start) + '\n')
+    return 0
@@ -0,0 +1,140 @@
+"""
+   lookupy.compact
+   ~~~~~~~~~~~~~~~
+
+   This module deals with representing loaded items compactly.
+
+   Collections of records such as HAR entries repeat the same keys
+   (and often the same values) in every item. Here, records having the
+   same keys share a single ``Shape`` that maps the keys to positions
+   and only the values are stored per record in a tuple. Strings are
+   interned so that repeated values are stored only once.
+
+"""
+
+import sys
+from collections.abc import Mapping
+
+
+class Shape(object):
+    """Keys shared by all records having them in the same order"""
+
+    __slots__ = ('keys', 'positions')
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.positions = dict((k, i) for i, k in enumerate(keys))
+
+
+class CompactRecord(Mapping):
+    """A read only dict-like record backed by a tuple of values
+
+    It supports everything that lookupy needs from the items
+    (``dunder_get`` and hence all lookups and select) and compares
+    equal to a dict having the same items. Use ``to_dict`` to convert it
+    back eg. for serializing it to json.
+
+    """
+
+    __slots__ = ('_shape', '_values')
+
+    def __init__(self, shape, values):
+        self._shape = shape
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._shape.positions[key]]
+
+    def __contains__(self, key):
+        return key in self._shape.positions
+
+    def __iter__(self):
+        return iter(self._shape.keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return 'CompactRecord({d!r})'.format(d=dict(self.items()))
+
+    def to_dict(self):
+        """Returns the record (and nested records) as plain dicts"""
+        return dict((k, _to_plain(v)) for k, v in zip(self._shape.keys, self._values))
+
+
+def _to_plain(value):
+    if isinstance(value, CompactRecord):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [_to_plain(v) for v in value]
+    return value
+
+
+class Compactor(object):
+    """Converts dicts into compact records
+
+    Shapes and interned strings are shared by all the records converted
+    by the same compactor, so a single compactor should be used for a
+    collection.
+
+    :param compact           : (boolean) whether to convert dicts to
+                               ``CompactRecord`` objects or to only
+                               intern the keys and values
+    :param max_intern_length : (int) strings longer than this are not
+                               interned as they seldom repeat
+
+    """
+
+    def __init__(self, compact=True, max_intern_length=256):
+        self.compact = compact
+        self.max_intern_length = max_intern_length
+        self.shapes = {}
+        self.strings = {}
+
+    def intern(self, value):
+        if isinstance(value, str) and len(value) <= self.max_intern_length:
+            return self.strings.setdefault(value, value)
+        return value
+
+    def from_pairs(self, pairs):
+        """Builds a record out of (key, value) pairs of already
+        converted values
+
+        Can be used as the ``object_pairs_hook`` of ``json.loads``.
+
+        """
+        keys = tuple(sys.intern(k) for k, _ in pairs)
+        values = tuple(self.intern(v) for _, v in pairs)
+        if not self.compact:
+            return dict(zip(keys, values))
+        shape = self.shapes.get(keys)
+        if shape is None:
+            shape = self.shapes[keys] = Shape(keys)
+        return CompactRecord(shape, values)
+
+    def __call__(self, value):
+        """Converts a dict (along with nested dicts and lists)
+
+        :param value : (mixed)
+        :rtype       : (mixed) converted value
+
+        """
+        if isinstance(value, dict):
+            return self.from_pairs([(k, self(v)) for k, v in value.items()])
+        if isinstance(value, list):
+            return [self(v) for v in value]
+        return self.intern(value)
+
+
+def compact_records(items, compact=True):
+    """Converts an iterable of dicts into compact records
+
+        >>> c = Collection(list(compact_records(data['log']['entries'])))
+
+    :param items   : iterable of dicts
+    :param compact : (boolean) False to only intern keys and values
+    :rtype         : lazy iterable
+
+    """
+    compactor = Compactor(compact)
+    return (compactor(item) for item in items)
@@ -0,0 +1,113 @@
+"""
+   lookupy.dates
+   ~~~~~~~~~~~~~
+
+   This module deals with timestamps in the data, which are usually
+   ISO 8601 strings eg. ``startedDateTime`` of HAR entries.
+
+   Timestamps are converted to timezone aware datetimes in UTC so that
+   they can be compared regardless of the offsets they were written
+   with. Timestamps without an offset are assumed to be in UTC. As the
+   same timestamp strings tend to repeat (and the same items are
+   filtered again and again), parsed strings are memoized in a cache
+   of bounded size.
+
+"""
+
+import math
+from functools import lru_cache
+from datetime import datetime, date, timezone
+
+
+# max number of parsed timestamp strings to remember
+CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_timestamp(s):
+    """Parses an ISO 8601 string into a datetime in UTC
+
+    :param s : (str) eg. '2013-07-12T10:01:35.123Z' or '2013-07-12'
+    :rtype   : (datetime) or None if the string isn't a timestamp
+
+    """
+    if s.endswith(('Z', 'z')):
+        s = s[:-1] + '+00:00'
+    try:
+        dt = datetime.fromisoformat(s)
+    except ValueError:
+        return None
+    return as_utc(dt)
+
+
+def as_utc(dt):
+    """Converts a datetime (or a date, at midnight) to UTC"""
+    if not isinstance(dt, datetime):
+        dt = datetime(dt.year, dt.month, dt.day)
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def to_datetime(value):
+    """Converts a value in the data to a datetime in UTC
+
+    :param value : (mixed) ISO 8601 string, datetime or date
+    :rtype       : (datetime) or None if the value isn't a timestamp
+
+    """
+    if isinstance(value, str):
+        return parse_timestamp(value)
+    if isinstance(value, date):
+        return as_utc(value)
+    return None
+
+
+def to_date(value):
+    """Converts a value to a date (the day of the timestamp in UTC)"""
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    dt = to_datetime(value)
+    return None if dt is None else dt.date()
+
+
+def to_epoch(value):
+    """Converts a value to seconds since the epoch (or None)"""
+    dt = to_datetime(value)
+    return None if dt is None else dt.timestamp()
+
+
+def is_datetime(value):
+    """Checks whether a lookup value is a date or a datetime"""
+    return isinstance(value, date)
+
+
+def epoch_bounds(op, val):
+    """Returns the range of timestamps that may satisfy a lookup
+
+    Only the lookups that compare timestamps (ie. against dates or
+    datetimes) are considered.
+
+    :param op  : (str) lookup type
+    :param val : (mixed) value to lookup
+    :rtype     : (tuple) of min and max seconds since the epoch (both
+                 inclusive) or None
+
+    """
+    if op in ('gt', 'gte', 'lt', 'lte') and is_datetime(val):
+        t = as_utc(val).timestamp()
+        return (t, math.inf) if op in ('gt', 'gte') else (-math.inf, t)
+    if op == 'range' and isinstance(val, (list, tuple)) and len(val) == 2 \
+       and all(is_datetime(v) for v in val):
+        return as_utc(val[0]).timestamp(), as_utc(val[1]).timestamp()
+    if op == 'date':
+        day = to_date(val)
+        if day is not None:
+            start = as_utc(day).timestamp()
+            return start, start + 86400
+    if op == 'year' and isinstance(val, int) and not isinstance(val, bool) \
+       and 1 <= val <= 9999:
+        start = datetime(val, 1, 1, tzinfo=timezone.utc).timestamp()
+        end = datetime(val + 1, 1, 1, tzinfo=timezone.utc).timestamp() if val < 9999 else math.inf
+        return start, end
+    return None
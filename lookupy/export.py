@@ -0,0 +1,136 @@
+"""
+   lookupy.export
+   ~~~~~~~~~~~~~~
+
+   This module deals with writing items to files in batches, as json
+   lines or csv. When only some fields of the items are to be written,
+   their values are serialized straight from the items instead of
+   building the intermediate dicts that ``select`` would.
+
+"""
+
+import csv
+import json
+from collections.abc import Mapping
+
+from .lookupy import batches
+from .dunderkey import dunder_get, dunder_truncate
+
+
+def _default(obj):
+    # items such as compact records are mappings but not dicts
+    if isinstance(obj, Mapping):
+        return dict(obj.items())
+    raise TypeError('{obj!r} is not JSON serializable'.format(obj=obj))
+
+
+def dumps(value):
+    return json.dumps(value, default=_default)
+
+
+def json_template(fields, flatten=False):
+    """Compiles a function that serializes fields of an item as json
+
+    The json is the same as that of the dict with the fields that
+    ``select`` would return, except that it's built directly out of
+    the values.
+
+    :param fields  : (list) dunder keys of the fields
+    :param flatten : (boolean) whether the keys are truncated
+    :rtype         : function that takes an item and returns (str) or
+                     None if the fields can't be converted to nested
+                     keys (eg. if both 'a' and 'a__b' are selected)
+
+    """
+    if flatten:
+        tree = dunder_truncate(dict((f, f) for f in fields))
+    else:
+        tree = {}
+        for field in fields:
+            parts = field.split('__')
+            node = tree
+            for p in parts[:-1]:
+                node = node.setdefault(p, {})
+                if not isinstance(node, dict):
+                    return None
+            if parts[-1] in node:
+                return None
+            node[parts[-1]] = field
+
+    # list of (literal, field) pairs, the value of the field is to be
+    # written after the literal
+    segments = []
+    def render(node, prefix):
+        prefix += '{'
+        for i, (key, sub) in enumerate(node.items()):
+            prefix += (', ' if i else '') + json.dumps(key) + ': '
+            if isinstance(sub, dict):
+                prefix = render(sub, prefix)
+            else:
+                segments.append((prefix, sub))
+                prefix = ''
+        return prefix + '}'
+    suffix = render(tree, '')
+
+    def serialize(item):
+        out = [lit + dumps(dunder_get(item, field)) for lit, field in segments]
+        out.append(suffix)
+        return ''.join(out)
+    return serialize
+
+
+def write_jsonl(items, fileobj, fields=None, flatten=False, batch_size=1000):
+    """Writes items to a file as json lines
+
+    :param items      : iterable of dicts
+    :param fileobj    : file object opened for writing text
+    :param fields     : (list) dunder keys of the fields to write or
+                        None to write the items as they are
+    :param flatten    : (boolean) whether to truncate the dunder keys
+    :param batch_size : (int) number of lines written at a time
+    :rtype            : (int) number of items written
+
+    """
+    serialize = dumps if fields is None else json_template(fields, flatten)
+    count = 0
+    for batch in batches(items, batch_size):
+        fileobj.write(''.join(serialize(item) + '\n' for item in batch))
+        count += len(batch)
+    return count
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (list, Mapping)):
+        return dumps(value)
+    return value
+
+
+def write_csv(items, fileobj, fields, header=True, batch_size=1000, names=None):
+    """Writes fields of the items to a file as csv
+
+    Missing values are written as empty strings and lists or dicts as
+    json.
+
+    :param items      : iterable of dicts
+    :param fileobj    : file object opened for writing text (with
+                        ``newline=''``)
+    :param fields     : (list) dunder keys of the fields, one per column
+    :param header     : (boolean) whether to write the field names as
+                        the first row
+    :param batch_size : (int) number of rows written at a time
+    :param names      : (list) names of the columns in the header,
+                        defaults to the fields
+    :rtype            : (int) number of items written
+
+    """
+    writer = csv.writer(fileobj)
+    if header:
+        writer.writerow(fields if names is None else names)
+    count = 0
+    for batch in batches(items, batch_size):
+        writer.writerows([_csv_value(dunder_get(item, f)) for f in fields]
+                         for item in batch)
+        count += len(batch)
+    return count
@@ -0,0 +1,144 @@
+"""
+   lookupy.expressions
+   ~~~~~~~~~~~~~~~~~~~
+
+   This module consists of expressions that compute values out of the
+   fields of an item eg::
+
+       >>> F('timings__send') + F('timings__receive')
+
+   Expressions can be used as the values of lookups, to compare fields
+   of an item with each other, and to annotate items with computed
+   fields::
+
+       >>> c.filter(timings__wait__gt=F('timings__send') + F('timings__receive'))
+       >>> c.annotate(total=F('timings__wait') * 2)
+
+   Like SQL's NULL, if the value of any field in an arithmetic
+   expression is None (or missing), so is the value of the expression.
+
+"""
+
+import operator
+
+from .dunderkey import dunder_get, dunder_getter
+
+
+class Expression(object):
+    """Base class for all expressions"""
+
+    def compile(self, get=dunder_get):
+        """Compiles the expression into a function of an item
+
+        :param get : function to get the value of a field from an item
+        :rtype     : function that takes an item and returns the value
+
+        """
+        raise NotImplementedError
+
+    def _combine(self, other, op, reverse=False):
+        if not isinstance(other, Expression):
+            other = Value(other)
+        return Combined(other, op, self) if reverse else Combined(self, op, other)
+
+    def __add__(self, other):
+        return self._combine(other, operator.add)
+
+    def __radd__(self, other):
+        return self._combine(other, operator.add, True)
+
+    def __sub__(self, other):
+        return self._combine(other, operator.sub)
+
+    def __rsub__(self, other):
+        return self._combine(other, operator.sub, True)
+
+    def __mul__(self, other):
+        return self._combine(other, operator.mul)
+
+    def __rmul__(self, other):
+        return self._combine(other, operator.mul, True)
+
+    def __truediv__(self, other):
+        return self._combine(other, operator.truediv)
+
+    def __rtruediv__(self, other):
+        return self._combine(other, operator.truediv, True)
+
+    def __floordiv__(self, other):
+        return self._combine(other, operator.floordiv)
+
+    def __rfloordiv__(self, other):
+        return self._combine(other, operator.floordiv, True)
+
+    def __mod__(self, other):
+        return self._combine(other, operator.mod)
+
+    def __rmod__(self, other):
+        return self._combine(other, operator.mod, True)
+
+    def __neg__(self):
+        return Combined(Value(0), operator.sub, self)
+
+
+class F(Expression):
+    """Refers to the value of a field of the item
+
+    :param field : (str) dunder key of the field
+
+    """
+
+    def __init__(self, field):
+        self.field = field
+
+    def compile(self, get=dunder_get):
+        if get is dunder_get:
+            # the key is split only once rather than for every item
+            return dunder_getter(self.field)
+        field = self.field
+        return lambda item: get(item, field)
+
+    def __repr__(self):
+        return 'F({f!r})'.format(f=self.field)
+
+
+class Value(Expression):
+    """A constant value"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def compile(self, get=dunder_get):
+        value = self.value
+        return lambda item: value
+
+    def __repr__(self):
+        return 'Value({v!r})'.format(v=self.value)
+
+
+class Combined(Expression):
+    """Two expressions combined using an arithmetic operator
+
+    :param lhs : ``Expression``
+    :param op  : function of two arguments eg. ``operator.add``
+    :param rhs : ``Expression``
+
+    """
+
+    def __init__(self, lhs, op, rhs):
+        self.lhs = lhs
+        self.op = op
+        self.rhs = rhs
+
+    def compile(self, get=dunder_get):
+        lhs, rhs, op = self.lhs.compile(get), self.rhs.compile(get), self.op
+        def evaluate(item):
+            a = lhs(item)
+            if a is None:
+                return None
+            b = rhs(item)
+            return None if b is None else op(a, b)
+        return evaluate
+
+    def __repr__(self):
+        return '({lhs!r} {op} {rhs!r})'.format(lhs=self.lhs, op=self.op.__name__, rhs=self.rhs)
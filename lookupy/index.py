@@ -0,0 +1,252 @@
+"""
+   lookupy.index
+   ~~~~~~~~~~~~~
+
+   This module deals with indexes that map the values of a field to
+   the positions of the items having them. Indexes are written in a
+   compact binary format and read through a buffer (usually a memory
+   mapped file) so that nothing needs to be parsed upfront.
+
+   Layout of an index segment (all ints little endian, all offsets
+   relative to the start of the segment)::
+
+       header     : magic (4s), nkeys (Q), nothers (Q), kinds (I)
+       directory  : nkeys * (key offset (Q), key length (I),
+                             postings offset (Q), postings count (I))
+       others     : nothers * position (Q)
+       keys       : json encoded keys
+       postings   : positions (Q)
+
+   The directory is sorted by the keys so that lookups can binary
+   search it. Items having values that can't be used as keys
+   (eg. lists or dicts) are recorded under "others" and are always
+   considered candidates.
+
+"""
+
+import json
+import math
+import struct
+
+
+SEGMENT_MAGIC = b'LKIX'
+
+_header = struct.Struct('<4sQQI')
+_dir_entry = struct.Struct('<QIQI')
+_position = struct.Struct('<Q')
+
+# kinds of values, used both for ordering keys and for recording
+# which kinds are present in an index
+KIND_NONE = 1
+KIND_NUMBER = 2
+KIND_STR = 4
+
+
+def value_kind(value):
+    """Returns the kind of a value or None if it can't be indexed
+
+    :param value : (mixed)
+    :rtype       : (int) or None
+
+    """
+    if value is None:
+        return KIND_NONE
+    if isinstance(value, (bool, int, float)):
+        return None if isinstance(value, float) and math.isnan(value) else KIND_NUMBER
+    if isinstance(value, str):
+        return KIND_STR
+    return None
+
+
+def value_key(value):
+    """Returns a key for ordering values of possibly different kinds
+
+    None comes first, then numbers (including bools) and then
+    strings. Values of the same kind are ordered naturally.
+
+    :param value : (mixed) an indexable value
+    :rtype       : (tuple)
+
+    """
+    kind = value_kind(value)
+    return (kind, 0) if kind == KIND_NONE else (kind, value)
+
+
+def write_index(fp, postings, others=()):
+    """Writes an index segment at the current position of a file
+
+    :param fp       : binary file object opened for writing
+    :param postings : (dict) mapping indexable values to lists of
+                      positions
+    :param others   : (list) positions of items having values that
+                      can't be indexed
+    :rtype          : (int) number of bytes written
+
+    """
+    keys = sorted(postings, key=value_key)
+    kinds = 0
+    for k in keys:
+        kinds |= value_kind(k)
+    encoded = [json.dumps(k, separators=(',', ':')).encode('utf-8') for k in keys]
+    key_start = _header.size + _dir_entry.size * len(keys) + _position.size * len(others)
+    post_start = key_start + sum(len(e) for e in encoded)
+
+    chunks = [_header.pack(SEGMENT_MAGIC, len(keys), len(others), kinds)]
+    key_off, post_off = key_start, post_start
+    for k, e in zip(keys, encoded):
+        chunks.append(_dir_entry.pack(key_off, len(e), post_off, len(postings[k])))
+        key_off += len(e)
+        post_off += _position.size * len(postings[k])
+    chunks.extend(_position.pack(p) for p in others)
+    chunks.extend(encoded)
+    for k in keys:
+        chunks.extend(_position.pack(p) for p in postings[k])
+    data = b''.join(chunks)
+    fp.write(data)
+    return len(data)
+
+
+def build_postings(pairs):
+    """Groups (position, value) pairs into postings
+
+    :param pairs : iterable of (position, value) 2 tuples
+    :rtype       : 2 tuple of (dict) postings and (list) others
+
+    """
+    postings, others = {}, []
+    for pos, val in pairs:
+        if value_kind(val) is None:
+            others.append(pos)
+        else:
+            postings.setdefault(val, []).append(pos)
+    return postings, others
+
+
+class MappedIndex(object):
+    """Reads an index segment from a buffer without loading it
+
+    :param buf  : object supporting the buffer protocol eg. ``mmap``
+    :param base : (int) offset of the segment in the buffer
+
+    """
+
+    def __init__(self, buf, base=0):
+        if len(buf) - base < _header.size:
+            raise ValueError('Truncated index segment')
+        magic, nkeys, nothers, kinds = _header.unpack_from(buf, base)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError('Not an index segment')
+        self.buf = buf
+        self.base = base
+        self.nkeys = nkeys
+        self.nothers = nothers
+        self.kinds = kinds
+        if self.base + self._end() > len(buf):
+            raise ValueError('Truncated index segment')
+
+    def _end(self):
+        # offset of the end of the segment, the postings of the last
+        # key come last
+        end = _header.size + _dir_entry.size * self.nkeys + _position.size * self.nothers
+        if self.nkeys and self.base + end <= len(self.buf):
+            _, _, post_off, count = self._entry(self.nkeys - 1)
+            end = post_off + _position.size * count
+        return end
+
+    def __len__(self):
+        return self.nkeys
+
+    def _entry(self, i):
+        return _dir_entry.unpack_from(self.buf, self.base + _header.size + _dir_entry.size * i)
+
+    def key(self, i):
+        """Returns the i-th key in sorted order"""
+        key_off, key_len, _, _ = self._entry(i)
+        start = self.base + key_off
+        return json.loads(bytes(self.buf[start:start+key_len]).decode('utf-8'))
+
+    def postings(self, i):
+        """Returns the positions for the i-th key in sorted order"""
+        _, _, post_off, count = self._entry(i)
+        start = self.base + post_off
+        return [p for (p,) in _position.iter_unpack(self.buf[start:start+_position.size*count])]
+
+    def others(self):
+        """Returns positions of items that couldn't be indexed"""
+        start = self.base + _header.size + _dir_entry.size * self.nkeys
+        return [p for (p,) in _position.iter_unpack(self.buf[start:start+_position.size*self.nothers])]
+
+    def bisect_left(self, value):
+        k = value_key(value)
+        lo, hi = 0, self.nkeys
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if value_key(self.key(mid)) < k:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def bisect_right(self, value):
+        k = value_key(value)
+        lo, hi = 0, self.nkeys
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if k < value_key(self.key(mid)):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def _slice(self, start, stop):
+        result = []
+        for i in range(start, stop):
+            result.extend(self.postings(i))
+        return result
+
+    def positions(self, op, val):
+        """Returns the positions of items that may satisfy a lookup
+
+        Items that couldn't be indexed are always included. Returns
+        None if the lookup can't be answered using the index in which
+        case all items need to be considered.
+
+        :param op  : (str) lookup type
+        :param val : (mixed) value to lookup
+        :rtype     : (list) positions or None
+
+        """
+        if op == 'exact':
+            if value_kind(val) is None:
+                return None
+            found = self._slice(self.bisect_left(val), self.bisect_right(val))
+        elif op == 'in':
+            # other iterables (eg. generators) can't be consumed here
+            if not isinstance(val, (list, tuple, set, frozenset)):
+                return None
+            vals = list(val)
+            if any(value_kind(v) is None for v in vals):
+                return None
+            found = []
+            for v in vals:
+                found.extend(self._slice(self.bisect_left(v), self.bisect_right(v)))
+        elif op in ('gt', 'gte', 'lt', 'lte'):
+            kind = value_kind(val)
+            # comparing values of different kinds raises an error
+            # which only a scan can reproduce
+            if kind in (None, KIND_NONE) or self.kinds & ~KIND_NONE & ~kind:
+                return None
+            # skip keys for None which never satisfy a comparison
+            lo, hi = self.bisect_right(None), self.nkeys
+            if op == 'gt':
+                lo = self.bisect_right(val)
+            elif op == 'gte':
+                lo = self.bisect_left(val)
+            elif op == 'lt':
+                hi = self.bisect_left(val)
+            else:
+                hi = self.bisect_right(val)
+            found = self._slice(lo, hi)
+        else:
+            return None
+        return found + self.others()
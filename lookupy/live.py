@@ -0,0 +1,127 @@
+"""
+   lookupy.live
+   ~~~~~~~~~~~~
+
+   This module deals with collections that grow over time eg. entries
+   tailed from a running proxy. QuerySets registered with a
+   ``LiveCollection`` are kept up to date as items are appended by
+   evaluating them only for the new items.
+
+"""
+
+from .lookupy import QuerySet, LookupyError, OrderStep, apply_steps, SKIP
+
+
+class StandingQuery(object):
+    """A QuerySet that's kept up to date with a LiveCollection
+
+    Instances are created by ``LiveCollection.register``.
+
+    :param steps      : (tuple) steps of the registered QuerySet
+    :param aggregates : (dict) mapping names to ``Aggregate`` objects
+    :param callback   : function called with every new result
+    :param keep       : (boolean) whether to keep the results
+
+    """
+
+    def __init__(self, steps, aggregates=None, callback=None, keep=True):
+        self.steps = steps
+        self.aggregates = dict((name, agg.copy())
+                               for name, agg in (aggregates or {}).items())
+        self.callback = callback
+        self.keep = keep
+        self.results = []
+
+    def push(self, item, notify=True):
+        """Evaluates the query for a new item
+
+        :param item   : (dict) the new item
+        :param notify : (boolean) whether to call the callback if the
+                        item results in a match
+        :rtype        : the result or ``SKIP`` if it doesn't match
+
+        """
+        result = apply_steps(self.steps, item)
+        if result is SKIP:
+            return result
+        if self.keep:
+            self.results.append(result)
+        for agg in self.aggregates.values():
+            agg.add(result)
+        if notify and self.callback is not None:
+            self.callback(result)
+        return result
+
+    @property
+    def values(self):
+        """Current values of the aggregates"""
+        return dict((name, agg.value) for name, agg in self.aggregates.items())
+
+    def __iter__(self):
+        return iter(self.results)
+
+
+class LiveCollection(QuerySet):
+    """Collection to which items can be appended
+
+        >>> live = LiveCollection()
+        >>> errors = live.register(live.filter(response__status__gte=500),
+        ...                        aggregates={'n': Count()},
+        ...                        callback=alert)
+        >>> live.extend(new_entries)
+        >>> errors.values
+        {'n': 3}
+
+    Filtering and selecting works just like with a ``Collection`` and
+    returns regular QuerySets that are evaluated over the items at the
+    time of consumption.
+
+    :param data: an iterable of dicts to start with
+
+    """
+
+    def __init__(self, data=()):
+        super(LiveCollection, self).__init__(list(data))
+        self.standing_queries = []
+
+    def _chain(self, step):
+        return QuerySet(step.run(self.data), self.source, self.steps + (step,))
+
+    def register(self, queryset, aggregates=None, callback=None, keep=True):
+        """Registers a QuerySet to be kept up to date
+
+        The QuerySet is evaluated over the existing items right away
+        (without calling the callback) and then over every appended
+        item.
+
+        :param queryset   : QuerySet derived from this collection, not
+                            ordered using ``order_by``
+        :param aggregates : (dict) mapping names to ``Aggregate``
+                            objects to be maintained over the results
+        :param callback   : function called with every new result
+        :param keep       : (boolean) False to not keep the results
+                            eg. if only the aggregates are needed
+        :rtype            : StandingQuery
+
+        """
+        if queryset.source is not self.data:
+            raise LookupyError('QuerySet not derived from this collection')
+        if any(isinstance(step, OrderStep) for step in queryset.steps):
+            raise LookupyError('Ordered QuerySets cannot be kept up to date')
+        sq = StandingQuery(queryset.steps, aggregates, callback, keep)
+        for item in self.data:
+            sq.push(item, notify=False)
+        self.standing_queries.append(sq)
+        return sq
+
+    def unregister(self, standing_query):
+        self.standing_queries.remove(standing_query)
+
+    def append(self, item):
+        self.data.append(item)
+        for sq in self.standing_queries:
+            sq.push(item)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
@@ -7,9 +7,18 @@
 """
 
 import re
+import sys
+import copy
+import operator
+from collections import deque
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 from .dunderkey import dunder_get, dunder_partition, undunder_keys, dunder_truncate
+from .aggregates import ApproxCountDistinct, ApproxQuantiles, Sample
+from .dates import as_utc, is_datetime, to_date, to_datetime
+from .index import value_kind, value_key
+from .expressions import Expression
 
 
 class QuerySet(object):
@@ -20,12 +29,28 @@ class QuerySet(object):
     relevant fields out of it. This object is internally created which
     means usually you, the user wouldn't need to create it.
 
-    :param data: an iterable of dicts
+    Besides the (lazy) data, a QuerySet also remembers the source it
+    was derived from and the steps (filter, select etc.) that were
+    applied to the source to derive it. This allows the same steps to
+    be applied to items one at a time eg. for items appended to a
+    ``LiveCollection``.
+
+    :param data   : an iterable of dicts
+    :param source : the iterable from which data was derived
+    :param steps  : (tuple) of steps applied to the source
 
     """
 
-    def __init__(self, data):
+    def __init__(self, data, source=None, steps=()):
         self.data = data
+        self.source = data if source is None else source
+        self.steps = tuple(steps)
+        # results of the QuerySet as a set, or a tuple if they can't
+        # be hashed (see ``contains_value``)
+        self._members = None
+
+    def _chain(self, step):
+        return self.__class__(step.run(self.data), self.source, self.steps + (step,))
 
     def filter(self, *args, **kwargs):
         """Filters data using the lookup parameters
@@ -73,7 +98,7 @@ class QuerySet(object):
         :rtype        : QuerySet
 
         """
-        return self.__class__(filter_items(self.data, *args, **kwargs))
+        return self._chain(FilterStep(*args, **kwargs))
 
     def select(self, *args, **kwargs):
         """Selects specific fields of the data
@@ -89,9 +114,371 @@ class QuerySet(object):
 
         """
         flatten = kwargs.pop('flatten', False)
-        f = dunder_truncate if flatten else undunder_keys
-        result = (f(d) for d in include_keys(self.data, args))
-        return self.__class__(result)
+        return self._chain(SelectStep(args, flatten))
+
+    def annotate(self, **kwargs):
+        """Adds fields computed using expressions to the data
+
+        The added fields can be used just like the others in the steps
+        that follow::
+
+            >>> c.annotate(total=F('timings__wait') + F('timings__receive')) \
+            ...  .filter(total__gt=1000) \
+            ...  .select('request__url', 'total')
+
+        :param kwargs : ``Expression`` objects (see
+                        ``lookupy.expressions``) by names of the fields
+        :rtype        : QuerySet
+
+        """
+        return self._chain(AnnotateStep(kwargs))
+
+    def values(self, *fields):
+        """Returns just the values of fields of the data
+
+        With a single field, the results are the values themselves
+        rather than dicts, which makes the QuerySet usable as the value
+        of an ``in`` lookup (a semi-join)::
+
+            >>> slow = c.filter(timings__wait__gt=1000).values('request__url')
+            >>> c.filter(request__url__in=slow)
+            >>> c.filter(~Q(request__url__in=slow))
+
+        :param fields : dunder keys of the fields
+        :rtype        : QuerySet of values, or of tuples of values if
+                        more than one field is specified
+
+        """
+        if not fields:
+            raise LookupyError('No fields specified')
+        return self._chain(ValuesStep(fields))
+
+    def order_by(self, *fields):
+        """Orders the data by the values of fields
+
+            >>> c.order_by('-response__status', 'request__url')
+
+        :param fields : dunder keys of the fields, prefixed with '-'
+                        for descending order
+        :rtype        : QuerySet
+
+        """
+        return self._chain(OrderStep(fields))
+
+    def paginate(self, page_size, after=None):
+        """Returns a page of the results of an ordered QuerySet
+
+        Pages are identified by opaque cursors rather than offsets::
+
+            >>> qs = c.filter(response__status=200).order_by('time')
+            >>> page = qs.paginate(50)
+            >>> page = qs.paginate(50, after=page.next_cursor)
+
+        If the QuerySet is ordered by a single field that's indexed
+        in the source, the index is used to seek to the cursor, so each
+        page costs about as much as the page size. Otherwise, the
+        source is scanned once per page but only the items on the page
+        are held in memory (see ``lookupy.paginate``).
+
+        :param page_size : (int) max number of results on the page
+        :param after     : (str) cursor of the previous page or None
+                           for the first page
+        :rtype           : ``Page``
+
+        """
+        from .paginate import paginate
+        return paginate(self, page_size, after)
+
+    def contains_value(self, value):
+        """Checks whether a value is one of the results
+
+        The results are evaluated (from the source) and held as a set
+        the first time this is called, so that later checks are
+        cheap. Changes to the source after that aren't reflected.
+
+        :param value : (mixed)
+        :rtype       : (boolean)
+
+        """
+        if self._members is None:
+            results = tuple(run_steps(self.source, self.steps))
+            # the results are kept as they are only if some of them
+            # are unhashable
+            members = frozen_members(results)
+            self._members = results if members is None else members
+        try:
+            return value in self._members
+        except TypeError:
+            # unhashable values are never equal to hashable results
+            return False
+
+    def run_many(self, queries):
+        """Evaluates many QuerySets in a single pass over the source
+
+        Every QuerySet must be derived from the same source as this
+        one. Instead of iterating over the source once per QuerySet,
+        each item is read only once and routed to the results of all
+        the QuerySets it matches. Values of fields used by more than
+        one QuerySet are looked up only once per item::
+
+            >>> c.run_many({'js': c.filter(response__content__mimeType='text/javascript'),
+            ...             'errors': c.filter(response__status__gte=400).select('request__url')})
+            {'js': [...], 'errors': [...]}
+
+        Results of ordered QuerySets are sorted after the pass.
+
+        :param queries : (dict) mapping names to QuerySets
+        :rtype         : (dict) mapping names to lists of results
+
+        """
+        shared = SharedGetter()
+        plans = []
+        ordered = {}
+        for name, qs in queries.items():
+            if qs.source is not self.source:
+                raise LookupyError('QuerySet "{name}" not derived from this source'.format(name=name))
+            steps, rest = split_at_order(qs.steps)
+            if rest:
+                # the results are ordered once all the items are seen
+                ordered[name] = rest
+            plans.append((name, [step.applier(shared.get) for step in steps]))
+        results = dict((name, []) for name in queries)
+        for item in self.source:
+            shared.reset(item)
+            for name, appliers in plans:
+                result = item
+                for apply in appliers:
+                    result = apply(result)
+                    if result is SKIP:
+                        break
+                else:
+                    results[name].append(result)
+        for name, rest in ordered.items():
+            results[name] = list(run_steps(results[name], rest))
+        return results
+
+    def iter_batches(self, size):
+        """Yields the results in lists of the specified size
+
+        :param size : (int) max number of results per list
+        :rtype      : lazy iterable of lists
+
+        """
+        return batches(self.data, size)
+
+    def _before_select(self):
+        # data before the last step if it's a select, so that the
+        # selected fields can be written without building the dicts.
+        # The steps are run again from the source and so serially even
+        # if the QuerySet was re-evaluated using ``threaded``
+        if self.steps and isinstance(self.steps[-1], SelectStep):
+            return run_steps(self.source, self.steps[:-1]), self.steps[-1]
+        return self.data, None
+
+    def to_jsonl(self, fileobj, batch_size=1000):
+        """Writes the results to a file as json lines
+
+        If the results are of a ``select``, the selected fields are
+        serialized directly out of the items. In that case, the steps
+        are evaluated again from the source without threads, even for a
+        QuerySet returned by ``threaded``.
+
+        :param fileobj    : file object opened for writing text
+        :param batch_size : (int) number of lines written at a time
+        :rtype            : (int) number of results written
+
+        """
+        from .export import write_jsonl, json_template
+        items, select = self._before_select()
+        if select is None or json_template(select.fields, select.flatten) is None:
+            return write_jsonl(self.data, fileobj, batch_size=batch_size)
+        return write_jsonl(items, fileobj, select.fields, select.flatten, batch_size)
+
+    def to_csv(self, fileobj, fields=None, header=True, batch_size=1000):
+        """Writes fields of the results to a file as csv
+
+            >>> with open('errors.csv', 'w', newline='') as f:
+            ...     c.filter(response__status__gte=500) \
+            ...      .to_csv(f, fields=['request__url', 'response__status'])
+
+        If the results are of a ``select``, the fields are written
+        directly out of the items, which means the steps are evaluated
+        again from the source without threads, even for a QuerySet
+        returned by ``threaded``.
+
+        :param fileobj    : file object opened for writing text
+        :param fields     : (list) keys of the fields, one per column.
+                            Defaults to the keys of the selected fields
+                            (truncated if they were flattened), which
+                            may also be given as their dunder keys
+        :param header     : (boolean) whether to write the field names
+                            as the first row
+        :param batch_size : (int) number of rows written at a time
+        :rtype            : (int) number of results written
+
+        """
+        from .export import write_csv
+        items, select = self._before_select()
+        if select is not None:
+            # keys of the results mapped to the fields they are selected
+            # from, in the order of the select
+            if select.flatten:
+                keys = dunder_truncate(dict((f, f) for f in select.fields))
+            else:
+                keys = dict((f, f) for f in select.fields)
+            if fields is None:
+                fields = list(keys)
+            # the selected fields can also be written by their dunder keys
+            sources = dict((f, f) for f in select.fields)
+            sources.update(keys)
+            if set(fields) <= set(sources):
+                return write_csv(items, fileobj, [sources[f] for f in fields], header,
+                                 batch_size, names=list(fields))
+        if fields is None:
+            raise LookupyError('Fields to write not specified')
+        return write_csv(self.data, fileobj, list(fields), header, batch_size)
+
+    def save(self, path, indexes=()):
+        """Saves the data to a snapshot file
+
+        The file can be loaded again using ``Collection.load`` much
+        faster than parsing json (see ``lookupy.snapshot``).
+
+        :param path    : path of the file to write
+        :param indexes : dunder keys of the fields to index
+
+        """
+        # imported here since snapshot depends on this module
+        from .snapshot import save
+        save(self.data, path, indexes)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a snapshot file saved using ``save``
+
+            >>> c = Collection.load('entries.lkpy')
+
+        :param path : path of the snapshot file
+        :rtype      : QuerySet
+
+        """
+        from .snapshot import SnapshotSource
+        return cls(SnapshotSource(path))
+
+    def threaded(self, workers=4, batch_size=1000, force=False):
+        """Re-evaluates the QuerySet using a pool of threads
+
+        The items of the source are split into batches and the steps
+        (filter, select etc.) are applied to the batches in parallel
+        threads. The results are in the same order as without threads.
+        Steps from the first ``order_by`` onwards are applied to the
+        results of the threads.
+
+        Threads only speed things up if they can run Python code in
+        parallel ie. on a free-threaded build of Python. On a regular
+        build, the overhead of the threads makes things slower, so the
+        QuerySet is evaluated serially unless ``force`` is True.
+
+        :param workers    : (int) number of threads
+        :param batch_size : (int) number of items per batch
+        :param force      : (boolean) use threads even if the
+                            interpreter has a GIL
+        :rtype            : QuerySet
+
+        """
+        if gil_enabled() and not force:
+            data = run_steps(self.source, self.steps)
+        else:
+            data = run_steps_threaded(self.source, self.steps, workers, batch_size)
+        return self.__class__(data, self.source, self.steps)
+
+    def specialize(self, sample_size=100):
+        """Re-evaluates the QuerySet using generated code
+
+        A sample of items from the source is used to infer the types of
+        the fields used in the filters. Code is then generated to access
+        these fields directly and evaluate the lookups on them (see
+        ``lookupy.specialize``). Items that don't match the inferred
+        schema are evaluated as usual, so the results are the same.
+
+        Only filters that are applied before any select are
+        specialized.
+
+        :param sample_size : (int) number of items to sample
+        :rtype             : QuerySet
+
+        """
+        from .specialize import specialize, sample_schema
+        if iter(self.source) is self.source:
+            raise LookupyError('Cannot sample an iterable that can be consumed only once')
+        filters = []
+        for step in self.steps:
+            if not isinstance(step, FilterStep):
+                break
+            filters.append(step)
+        lookup_groups = [lg for f in filters for lg in f.lookup_groups]
+        schema = sample_schema(self.source, lookup_groups, sample_size)
+        steps = list(self.steps)
+        for i, step in enumerate(filters):
+            steps[i] = copy.copy(step)
+            steps[i]._predicate = specialize(step.lookup_groups, schema, step.compile())
+        return self.__class__(run_steps(self.source, steps), self.source, steps)
+
+    def aggregate(self, **kwargs):
+        """Computes aggregates over the data in a single pass
+
+            >>> c.aggregate(n=Count(), wait=Avg('timings__wait'))
+            {'n': 42, 'wait': 61.5}
+
+        :param kwargs : ``Aggregate`` objects (see ``lookupy.aggregates``)
+        :rtype        : (dict) mapping names to aggregated values
+
+        """
+        aggregates = dict((name, agg.copy()) for name, agg in kwargs.items())
+        for item in self.data:
+            for agg in aggregates.values():
+                agg.add(item)
+        return dict((name, agg.value) for name, agg in aggregates.items())
+
+    def sample(self, n, seed=None):
+        """Returns a uniform random sample of the data
+
+        The data is consumed in a single pass keeping at most ``n``
+        items in memory (reservoir sampling).
+
+        :param n    : (int) size of the sample
+        :param seed : seed for the random choices
+        :rtype      : (list) of items
+
+        """
+        return self.aggregate(s=Sample(n, seed))['s']
+
+    def approx_count_distinct(self, field, precision=14):
+        """Estimates the number of distinct values of a field
+
+        Uses a HyperLogLog sketch of ``2 ** precision`` bytes instead of
+        keeping all the distinct values in memory.
+
+        :param field     : (str) dunder key of the field
+        :param precision : (int) between 4 and 18
+        :rtype           : (int)
+
+        """
+        return self.aggregate(n=ApproxCountDistinct(field, precision))['n']
+
+    def approx_quantiles(self, field, quantiles, k=200):
+        """Estimates the values of a field at the specified quantiles
+
+            >>> c.approx_quantiles('timings__wait', [0.5, 0.99])
+            [45, 1210]
+
+        :param field     : (str) dunder key of the field
+        :param quantiles : (list) of quantiles between 0 and 1
+        :param k         : (int) accuracy parameter of the sketch
+        :rtype           : (list)
+
+        """
+        return self.aggregate(q=ApproxQuantiles(field, quantiles, k))['q']
 
     def __iter__(self):
         for d in self.data:
@@ -102,6 +489,353 @@ class QuerySet(object):
 Collection = QuerySet
 
 
+## Steps that make up a QuerySet
+
+# returned by steps for items that are filtered out
+SKIP = object()
+
+
+class FilterStep(object):
+    """Step that keeps only the items matching the lookup parameters
+
+    :param args   : ``Q`` objects
+    :param kwargs : lookup parameters
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.lookup_groups = list(args) + [Q(**kwargs)]
+        self._predicate = None
+
+    def compile(self, get=dunder_get):
+        """Returns a function that checks whether an item matches
+
+        :param get : function to get the value of a field from an item
+        :rtype     : function
+
+        """
+        predicates = [lg.compile(get) for lg in self.lookup_groups]
+        return lambda item: all(p(item) for p in predicates)
+
+    def matches(self, item):
+        # compiled lazily so that invalid lookups raise errors only
+        # when the items are consumed
+        if self._predicate is None:
+            self._predicate = self.compile()
+        return self._predicate(item)
+
+    def applier(self, get=dunder_get):
+        matches = self.compile(get)
+        return lambda item: item if matches(item) else SKIP
+
+    def apply(self, item):
+        return item if self.matches(item) else SKIP
+
+    def run(self, items):
+        if hasattr(items, 'candidates'):
+            # sources that can rule out items up front (eg. using an
+            # index) only hand over the ones that may match
+            items = items.candidates(self.lookup_groups)
+        return (item for item in items if self.matches(item))
+
+
+class SelectStep(object):
+    """Step that keeps only the specified fields of the items
+
+    :param fields  : (tuple) field names to select
+    :param flatten : (boolean) whether to truncate the dunder keys
+                     instead of converting them to nested dicts
+
+    """
+
+    def __init__(self, fields, flatten=False):
+        self.fields = tuple(fields)
+        self.flatten = flatten
+
+    def applier(self, get=dunder_get):
+        f = dunder_truncate if self.flatten else undunder_keys
+        fields = self.fields
+        return lambda item: f(dict((k, get(item, k)) for k in fields))
+
+    def apply(self, item):
+        f = dunder_truncate if self.flatten else undunder_keys
+        return f(dict((k, dunder_get(item, k)) for k in self.fields))
+
+    def run(self, items):
+        return (self.apply(item) for item in items)
+
+
+class ValuesStep(object):
+    """Step that replaces the items with the values of fields
+
+    :param fields : (tuple) field names. If there's only one, the value
+                    itself is the result otherwise a tuple of values
+
+    """
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self._apply = None
+
+    def applier(self, get=dunder_get):
+        fields = self.fields
+        if len(fields) == 1:
+            field = fields[0]
+            return lambda item: get(item, field)
+        return lambda item: tuple(get(item, f) for f in fields)
+
+    def apply(self, item):
+        # built once and reused for the items that follow
+        if self._apply is None:
+            self._apply = self.applier()
+        return self._apply(item)
+
+    def run(self, items):
+        return (self.apply(item) for item in items)
+
+
+class AnnotateStep(object):
+    """Step that adds fields computed using expressions to the items
+
+    The items are copied (as dicts) rather than modified.
+
+    :param annotations : (dict) mapping names of the fields to
+                         ``Expression`` objects
+
+    """
+
+    def __init__(self, annotations):
+        for name, expr in annotations.items():
+            if '__' in name:
+                raise LookupyError('Name of an annotation cannot contain "__": {name}'.format(name=name))
+            if not isinstance(expr, Expression):
+                raise LookupyError('Annotation {name} not an expression'.format(name=name))
+        self.annotations = annotations
+        self._apply = None
+
+    def applier(self, get=dunder_get):
+        computed = [(name, expr.compile(get)) for name, expr in self.annotations.items()]
+        def apply(item):
+            result = dict(item)
+            for name, value in computed:
+                result[name] = value(item)
+            return result
+        return apply
+
+    def apply(self, item):
+        # the expressions are compiled only once
+        if self._apply is None:
+            self._apply = self.applier()
+        return self._apply(item)
+
+    def run(self, items):
+        return (self.apply(item) for item in items)
+
+
+class OrderStep(object):
+    """Step that sorts the items by the values of fields
+
+    None comes first, then numbers and then strings (see
+    ``lookupy.index.value_key``). Items having equal values remain in
+    the order they were in. Since all the items need to be seen before
+    the first one can be returned, this step can't be applied to items
+    one at a time.
+
+    :param fields : (tuple) field names, prefixed with '-' for
+                    descending order
+
+    """
+
+    def __init__(self, fields):
+        if not fields:
+            raise LookupyError('No fields specified')
+        self.fields = tuple(fields)
+        self.orders = [(f[1:], True) if f.startswith('-') else (f, False)
+                       for f in self.fields]
+
+    def values(self, item, get=dunder_get):
+        """Returns the values of the fields to order an item by"""
+        return [get(item, f) for f, _ in self.orders]
+
+    def key(self, values):
+        """Returns the sort key for values returned by ``values``"""
+        key = []
+        for (field, descending), v in zip(self.orders, values):
+            if value_kind(v) is None:
+                raise LookupyError('Cannot order by {field}, value {v!r} not a number or string'.format(field=field, v=v))
+            k = value_key(v)
+            key.append(Descending(k) if descending else k)
+        return tuple(key)
+
+    def applier(self, get=dunder_get):
+        raise LookupyError('Ordering cannot be applied to items one at a time')
+
+    def apply(self, item):
+        return self.applier()(item)
+
+    def run(self, items):
+        for item in sorted(items, key=lambda item: self.key(self.values(item))):
+            yield item
+
+
+class Descending(object):
+    """Wraps a sort key to reverse the order"""
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __gt__(self, other):
+        return other.key > self.key
+
+    def __le__(self, other):
+        return other.key <= self.key
+
+    def __ge__(self, other):
+        return other.key >= self.key
+
+
+class SharedGetter(object):
+    """Memoizes the values of fields of an item
+
+    Lookups compiled with the ``get`` method of the same instance share
+    the values of fields of the item that was last passed to
+    ``reset``. Values of fields of any other items (eg. the results of
+    a select step) are not memoized.
+
+    """
+
+    def __init__(self):
+        self.item = None
+        self.values = {}
+
+    def reset(self, item):
+        self.item = item
+        self.values = {}
+
+    def get(self, item, field):
+        if item is not self.item:
+            return dunder_get(item, field)
+        try:
+            return self.values[field]
+        except KeyError:
+            value = self.values[field] = dunder_get(item, field)
+            return value
+
+
+def apply_steps(steps, item):
+    """Applies steps to a single item
+
+    :param steps : (tuple) of steps
+    :param item  : (dict)
+    :rtype       : the resulting item or ``SKIP`` if it's filtered out
+
+    """
+    for step in steps:
+        item = step.apply(item)
+        if item is SKIP:
+            break
+    return item
+
+
+def run_steps(items, steps):
+    """Applies steps to an iterable
+
+    :param items : iterable
+    :param steps : (tuple) of steps
+    :rtype       : lazy iterable
+
+    """
+    for step in steps:
+        items = step.run(items)
+    return items
+
+
+def split_at_order(steps):
+    """Splits steps at the first ordering
+
+    Only the steps before it can be applied to items one at a time.
+
+    :param steps : (tuple) of steps
+    :rtype       : 2 tuple of the steps before the first ``OrderStep``
+                   and the rest
+
+    """
+    for i, step in enumerate(steps):
+        if isinstance(step, OrderStep):
+            return steps[:i], steps[i:]
+    return steps, ()
+
+
+def gil_enabled():
+    """Checks whether the interpreter has a global interpreter lock"""
+    return getattr(sys, '_is_gil_enabled', lambda: True)()
+
+
+def batches(items, size):
+    """Splits an iterable into lists of the specified size
+
+    :param items : iterable
+    :param size  : (int) max number of items per batch
+    :rtype       : lazy iterable of lists
+
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run_steps_threaded(items, steps, workers, batch_size):
+    """Applies steps to batches of items in a pool of threads
+
+    The results are yielded in the same order as by ``run_steps``. Only
+    a bounded number of batches are in flight at a time.
+
+    :param items      : iterable
+    :param steps      : (tuple) of steps
+    :param workers    : (int) number of threads
+    :param batch_size : (int) number of items per batch
+    :rtype            : lazy iterable
+
+    """
+    # steps after an ordering need all the items at once so they are
+    # applied to the results of the threads
+    steps, rest = split_at_order(steps)
+    return run_steps(_run_batches_threaded(items, steps, workers, batch_size), rest)
+
+
+def _run_batches_threaded(items, steps, workers, batch_size):
+    if steps and isinstance(steps[0], FilterStep) and hasattr(items, 'candidates'):
+        items = items.candidates(steps[0].lookup_groups)
+
+    def run_batch(batch):
+        results = (apply_steps(steps, item) for item in batch)
+        return [r for r in results if r is not SKIP]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for batch in batches(items, batch_size):
+            pending.append(executor.submit(run_batch, batch))
+            if len(pending) >= 2 * workers:
+                for result in pending.popleft().result():
+                    yield result
+        while pending:
+            for result in pending.popleft().result():
+                yield result
+
+
 ## filter and lookup functions
 
 def filter_items(items, *args, **kwargs):
@@ -113,11 +847,47 @@ def filter_items(items, *args, **kwargs):
     :rtype        : lazy iterable (generator)
 
     """
-    q1 = list(args) if args is not None else []
-    q2 = [Q(**kwargs)] if kwargs is not None else []
-    lookup_groups = q1 + q2
-    pred = lambda item: all(lg.evaluate(item) for lg in lookup_groups)
-    return (item for item in items if pred(item))
+    return FilterStep(*args, **kwargs).run(items)
+
+
+def parse_lookup(key):
+    """Splits a lookup parameter into the field and the lookup type
+
+        >>> parse_lookup('response__status__gte')
+        ('response__status', 'gte')
+        >>> parse_lookup('response__status')
+        ('response__status', 'exact')
+
+    :param key : (str) lookup parameter
+    :rtype     : 2 tuple
+
+    """
+    init, last = dunder_partition(key)
+    return (init, last) if last in LOOKUP_TYPES else (key, 'exact')
+
+
+def conjunctive_lookups(lookup_groups):
+    """Yields the lookups that every matching item must satisfy
+
+    Only the lookups that are and-ed together at the top level of the
+    lookup groups are considered ie. lookups under an *or* or a *not*
+    are skipped. This makes it safe to use them for ruling out items
+    before actually evaluating the lookup groups.
+
+    :param lookup_groups : (list) of ``Q`` objects
+    :rtype               : lazy iterable of (field, lookuptype, val)
+
+    """
+    for lg in lookup_groups:
+        if lg.negate:
+            continue
+        if isinstance(lg, LookupLeaf):
+            for k, v in lg.lookups.items():
+                field, op = parse_lookup(k)
+                yield field, op, v
+        elif lg.op == 'and':
+            for l in conjunctive_lookups(lg.children):
+                yield l
 
 
 def lookup(key, val, item):
@@ -137,48 +907,175 @@ def lookup(key, val, item):
     :rtype      : (boolean) True if field-val exists else False
 
     """
-    init, last = dunder_partition(key)
+    field, last = parse_lookup(key)
+    if last == 'in' and not isinstance(val, QuerySet):
+        # converting the value to a set doesn't pay off for a single
+        # item, unlike when the lookup is compiled
+        return dunder_get(item, field) in guard_iter(val)
+    return compile_lookup(key, val)(item)
+
+
+def compile_lookup(key, val, get=dunder_get):
+    """Compiles a lookup into a function that checks it for an item
+
+    All the work that doesn't depend on the item (finding out the
+    lookup type, validating the value etc.) is done only once, so the
+    returned function is cheaper to call than ``lookup`` when checking
+    many items::
+
+        >>> check = compile_lookup('request__url__exact', 'http://example.com')
+        >>> check(item)
+
+    :param key  : (str) that represents the field name to find
+    :param val  : (mixed) object to match the value in the item against
+    :param get  : function to get the value of a field from an item
+    :rtype      : function that takes an item and returns (boolean)
+
+    """
+    field, last = parse_lookup(key)
+    if isinstance(val, Expression):
+        return compile_expression_lookup(field, last, val, get)
     if last == 'exact':
-        return dunder_get(item, init) == val
+        return lambda item: get(item, field) == val
     elif last == 'neq':
-        return dunder_get(item, init) != val
+        return lambda item: get(item, field) != val
     elif last == 'contains':
         val = guard_str(val)
-        return iff_not_none(dunder_get(item, init), lambda y: val in y)
+        return lambda item: iff_not_none(get(item, field), lambda y: val in y)
     elif last == 'icontains':
-        val = guard_str(val)
-        return iff_not_none(dunder_get(item, init), lambda y: val.lower() in y.lower())
+        val = guard_str(val).lower()
+        return lambda item: iff_not_none(get(item, field), lambda y: val in y.lower())
     elif last == 'in':
+        if isinstance(val, QuerySet):
+            # values of a subquery are materialized only when the
+            # first item is checked
+            return lambda item: val.contains_value(get(item, field))
         val = guard_iter(val)
-        return dunder_get(item, init) in val
+        if iter(val) is val:
+            # iterators (eg. generators) can be consumed only once
+            val = tuple(val)
+        members = frozen_members(val)
+        if members is None:
+            return lambda item: get(item, field) in val
+        def check(item):
+            value = get(item, field)
+            try:
+                return value in members
+            except TypeError:
+                # unhashable values are compared one by one
+                return value in val
+        return check
     elif last == 'startswith':
         val = guard_str(val)
-        return iff_not_none(dunder_get(item, init), lambda y: y.startswith(val))
+        return lambda item: iff_not_none(get(item, field), lambda y: y.startswith(val))
     elif last == 'istartswith':
-        val = guard_str(val)
-        return iff_not_none(dunder_get(item, init), lambda y: y.lower().startswith(val.lower()))
+        val = guard_str(val).lower()
+        return lambda item: iff_not_none(get(item, field), lambda y: y.lower().startswith(val))
     elif last == 'endswith':
         val = guard_str(val)
-        return iff_not_none(dunder_get(item, init), lambda y: y.endswith(val))
+        return lambda item: iff_not_none(get(item, field), lambda y: y.endswith(val))
     elif last == 'iendswith':
-        val = guard_str(val)
-        return iff_not_none(dunder_get(item, init), lambda y: y.lower().endswith(val.lower()))
+        val = guard_str(val).lower()
+        return lambda item: iff_not_none(get(item, field), lambda y: y.lower().endswith(val))
+    elif last in ('gt', 'gte', 'lt', 'lte') and is_datetime(val):
+        # timestamps in the items are compared as datetimes
+        return compile_datetime_lookup(field, last, as_utc(val), get)
     elif last == 'gt':
-        return iff_not_none(dunder_get(item, init), lambda y: y > val)
+        return lambda item: iff_not_none(get(item, field), lambda y: y > val)
     elif last == 'gte':
-        return iff_not_none(dunder_get(item, init), lambda y: y >= val)
+        return lambda item: iff_not_none(get(item, field), lambda y: y >= val)
     elif last == 'lt':
-        return iff_not_none(dunder_get(item, init), lambda y: y < val)
+        return lambda item: iff_not_none(get(item, field), lambda y: y < val)
     elif last == 'lte':
-        return iff_not_none(dunder_get(item, init), lambda y: y <= val)
+        return lambda item: iff_not_none(get(item, field), lambda y: y <= val)
+    elif last == 'range':
+        lo, hi = guard_range(val)
+        if is_datetime(lo) and is_datetime(hi):
+            lo, hi = as_utc(lo), as_utc(hi)
+            return lambda item: iff_not_none(to_datetime(get(item, field)), lambda y: lo <= y <= hi)
+        return lambda item: iff_not_none(get(item, field), lambda y: lo <= y <= hi)
+    elif last == 'date':
+        day = to_date(val)
+        if day is None:
+            raise LookupyError('Value not a date')
+        return lambda item: to_date(get(item, field)) == day
+    elif last == 'year':
+        year = guard_int(val)
+        return lambda item: iff_not_none(to_datetime(get(item, field)), lambda y: y.year == year)
     elif last == 'regex':
-        return iff_not_none(dunder_get(item, init), lambda y: re.search(val, y) is not None)
+        pattern = re.compile(val)
+        return lambda item: iff_not_none(get(item, field), lambda y: pattern.search(y) is not None)
     elif last == 'filter':
         val = guard_Q(val)
-        result = guard_list(dunder_get(item, init))
-        return len(list(filter_items(result, val))) > 0
-    else:
-        return dunder_get(item, key) == val
+        return lambda item: len(list(filter_items(guard_list(get(item, field)), val))) > 0
+
+
+LOOKUP_TYPES = ('exact', 'neq', 'contains', 'icontains', 'in',
+                'startswith', 'istartswith', 'endswith', 'iendswith',
+                'gt', 'gte', 'lt', 'lte', 'regex', 'filter',
+                'range', 'date', 'year')
+
+
+# functions for the lookup types that can compare a field with an
+# expression
+_expression_ops = {'exact': operator.eq,
+                   'neq': operator.ne,
+                   'gt': operator.gt,
+                   'gte': operator.ge,
+                   'lt': operator.lt,
+                   'lte': operator.le}
+
+
+def compile_expression_lookup(field, op, expr, get=dunder_get):
+    """Compiles a lookup comparing a field with an expression
+
+        >>> check = compile_expression_lookup('timings__wait', 'gt',
+        ...                                   F('timings__send') * 2)
+
+    Ordering lookups (gt, gte, lt, lte) don't hold if either the value
+    of the field or of the expression is None.
+
+    :param field : (str) dunder key of the field
+    :param op    : (str) one of 'exact', 'neq', 'gt', 'gte', 'lt' or
+                   'lte'
+    :param expr  : ``Expression`` eg. ``F('timings__send')``
+    :param get   : function to get the value of a field from an item
+    :rtype       : function that takes an item and returns (boolean)
+
+    """
+    if op not in _expression_ops:
+        raise LookupyError('Lookup type {op} cannot be used with expressions'.format(op=op))
+    compare, value = _expression_ops[op], expr.compile(get)
+    if op in ('exact', 'neq'):
+        return lambda item: compare(get(item, field), value(item))
+    def check(item):
+        x = get(item, field)
+        if x is None:
+            return False
+        y = value(item)
+        return y is not None and compare(x, y)
+    return check
+
+
+def compile_datetime_lookup(field, op, bound, get=dunder_get):
+    """Compiles a comparison of timestamps in the items with a datetime
+
+    The values in the items (ISO 8601 strings, dates or datetimes) are
+    converted to datetimes in UTC using ``to_datetime``; items for
+    which that's not possible never satisfy the lookup.
+
+    :param field : (str) dunder key of the field
+    :param op    : (str) one of 'gt', 'gte', 'lt' or 'lte'
+    :param bound : (datetime) aware datetime to compare with
+    :param get   : function to get the value of a field from an item
+    :rtype       : function that takes an item and returns (boolean)
+
+    """
+    compare = {'gt': lambda y: y > bound,
+               'gte': lambda y: y >= bound,
+               'lt': lambda y: y < bound,
+               'lte': lambda y: y <= bound}[op]
+    return lambda item: iff_not_none(to_datetime(get(item, field)), compare)
 
 
 ## Classes to compose compound lookups (Q object)
@@ -192,6 +1089,15 @@ class LookupTreeElem(object):
     def evaluate(self, item):
         raise NotImplementedError
 
+    def compile(self, get=dunder_get):
+        """Compiles the expression into a function of an item
+
+        :param get : function to get the value of a field from an item
+        :rtype     : function that takes an item and returns (boolean)
+
+        """
+        raise NotImplementedError
+
     def __or__(self, other):
         node = LookupNode()
         node.op = 'or'
@@ -235,10 +1141,20 @@ class LookupNode(LookupTreeElem):
         result = any(results) if self.op == 'or' else all(results)
         return not result if self.negate else result
 
+    def compile(self, get=dunder_get):
+        predicates = [c.compile(get) for c in self.children]
+        combine = any if self.op == 'or' else all
+        negate = self.negate
+        def predicate(item):
+            result = combine(p(item) for p in predicates)
+            return not result if negate else result
+        return predicate
+
     def __invert__(self):
         newnode = LookupNode()
         for c in self.children:
             newnode.add_child(c)
+        newnode.op = self.op
         newnode.negate = not self.negate
         return newnode
 
@@ -249,16 +1165,29 @@ class LookupLeaf(LookupTreeElem):
     def __init__(self, **kwargs):
         super(LookupLeaf, self).__init__()
         self.lookups = kwargs
+        self._predicate = None
 
     def evaluate(self, item):
         """Evaluates the expression represented by the object for the item
 
+        The lookups are compiled the first time and reused for the
+        items that follow.
+
         :param item : (dict) item
         :rtype      : (boolean) whether lookup passed or failed
 
         """
-        result = all(lookup(k, v, item) for k, v in self.lookups.items())
-        return not result if self.negate else result
+        if self._predicate is None:
+            self._predicate = self.compile()
+        return self._predicate(item)
+
+    def compile(self, get=dunder_get):
+        checks = [compile_lookup(k, v, get) for k, v in self.lookups.items()]
+        negate = self.negate
+        def predicate(item):
+            result = all(c(item) for c in checks)
+            return not result if negate else result
+        return predicate
 
     def __invert__(self):
         newleaf = LookupLeaf(**self.lookups)
@@ -322,6 +1251,31 @@ guard_str = partial(guard_type, str)
 guard_list = partial(guard_type, list)
 guard_Q = partial(guard_type, Q)
 
+def guard_int(val):
+    if not isinstance(val, int) or isinstance(val, bool):
+        raise LookupyError('Value not an int')
+    return val
+
+def guard_range(val):
+    if not isinstance(val, (list, tuple)) or len(val) != 2:
+        raise LookupyError('Value not a pair of bounds')
+    return val
+
+def frozen_members(val):
+    """Converts a list or tuple to a frozenset for membership tests
+
+    :param val : (mixed) value of an ``in`` lookup
+    :rtype     : (frozenset) or None if the value isn't a list or tuple
+                 or if some of its elements are unhashable
+
+    """
+    if not isinstance(val, (list, tuple)):
+        return None
+    try:
+        return frozenset(val)
+    except TypeError:
+        return None
+
 def guard_iter(val):
     try:
         iter(val)
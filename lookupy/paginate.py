@@ -0,0 +1,324 @@
+"""
+   lookupy.paginate
+   ~~~~~~~~~~~~~~~~
+
+   This module deals with paging through the results of an ordered
+   QuerySet using cursors (aka. keyset pagination).
+
+   A cursor encodes the values of the order fields of the last item on
+   a page along with its position in the source, which breaks ties
+   between items having the same values. The next page consists of the
+   items that come after it in order. Unlike with offsets, the items of
+   the previous pages don't need to be sorted (or even read, if an
+   index or the order of the source can be used) to get to the next
+   page.
+
+"""
+
+import json
+import heapq
+import base64
+from itertools import islice, tee
+from operator import itemgetter
+
+from .lookupy import OrderStep, FilterStep, LookupyError, SKIP
+from .dunderkey import dunder_get
+from .index import value_key
+
+
+class Page(object):
+    """A page of results
+
+    :param items       : (list) results on the page
+    :param next_cursor : (str) cursor for the next page or None if
+                         this is the last page
+
+    """
+
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(order, values, position):
+    """Encodes the cursor for an item as an opaque url safe string
+
+    :param order    : ``OrderStep`` of the QuerySet
+    :param values   : (list) values of the order fields of the item
+    :param position : position of the item in the source
+    :rtype          : (str)
+
+    """
+    data = json.dumps({'o': list(order.fields), 'v': values, 'p': position},
+                      separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(order, cursor):
+    """Decodes a cursor returned by ``encode_cursor``
+
+    :param order  : ``OrderStep`` of the QuerySet
+    :param cursor : (str)
+    :rtype        : 2 tuple of the sort key of the item (including its
+                    position) and the values of the order fields
+
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        fields, values, position = data['o'], data['v'], data['p']
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise LookupyError('Invalid cursor')
+    if fields != list(order.fields) or not isinstance(values, list) \
+       or len(values) != len(fields):
+        raise LookupyError('Cursor not of a QuerySet ordered by the same fields')
+    return order.key(values) + (position,), values
+
+
+def split_steps(steps):
+    """Splits steps into the ones before, at and after the last ordering
+
+    :param steps : (tuple) of steps
+    :rtype       : 3 tuple of steps before, the ``OrderStep`` and the
+                   steps after it
+
+    """
+    for i in reversed(range(len(steps))):
+        if isinstance(steps[i], OrderStep):
+            return steps[:i], steps[i], steps[i+1:]
+    raise LookupyError('QuerySet must be ordered (using order_by) to be paginated')
+
+
+def compose(steps):
+    """Composes the steps into a single function of an item"""
+    appliers = [step.applier() for step in steps]
+    def apply(item):
+        for applier in appliers:
+            item = applier(item)
+            if item is SKIP:
+                break
+        return item
+    return apply
+
+
+def positioned(source):
+    if hasattr(source, 'positioned'):
+        return source.positioned()
+    return enumerate(source)
+
+
+def scan(source, before, order, after, cursor, n):
+    """Finds the first n results after the cursor in a single pass
+
+    Only n results are held in memory at a time.
+
+    :rtype: (list) of (key, values, position, result) 4 tuples
+
+    """
+    before, after = compose(before), compose(after)
+    def candidates():
+        for position, item in positioned(source):
+            item = before(item)
+            if item is SKIP:
+                continue
+            values = order.values(item)
+            key = order.key(values) + (position,)
+            if cursor is not None and key <= cursor:
+                continue
+            result = after(item)
+            if result is not SKIP:
+                yield key, values, position, result
+    return heapq.nsmallest(n, candidates(), key=itemgetter(0))
+
+
+def seekable(before, order):
+    # cursors can be seeked to only if the QuerySet is ordered by a
+    # single field and only filters are applied to the items before
+    # ordering
+    return len(order.orders) == 1 and all(isinstance(s, FilterStep) for s in before)
+
+
+def usable_index(source, before, order):
+    """Returns the index that can be used to seek to cursors or None
+
+    An index can be used if the QuerySet is ordered by a single
+    indexed field, the values of which could all be indexed, and only
+    filters are applied to the items before ordering.
+
+    """
+    if not seekable(before, order):
+        return None
+    field, _ = order.orders[0]
+    if hasattr(source, 'drop_stale'):
+        source.drop_stale()
+    index = getattr(source, 'indexes', {}).get(field)
+    if index is None or index.nothers:
+        return None
+    return index
+
+
+def seek(source, index, before, order, after, cursor, values, n):
+    """Finds the first n results after the cursor using an index
+
+    Keys of the index are visited in order starting from the value in
+    the cursor and only the items at their positions are read.
+
+    :rtype: (list) of (key, values, position, result) 4 tuples
+
+    """
+    _, descending = order.orders[0]
+    if descending:
+        start = index.nkeys - 1 if cursor is None else index.bisect_right(values[0]) - 1
+        keys = range(start, -1, -1)
+    else:
+        start = 0 if cursor is None else index.bisect_left(values[0])
+        keys = range(start, index.nkeys)
+
+    def entries():
+        for i in keys:
+            value = index.key(i)
+            sort_key = order.key([value])
+            for position in index.postings(i):
+                key = sort_key + (position,)
+                if cursor is None or key > cursor:
+                    yield key, value, position
+
+    before, after = compose(before), compose(after)
+    def candidates():
+        pending, to_read = tee(entries())
+        items = source.items_at(position for _, _, position in to_read)
+        for (key, value, position), item in zip(pending, items):
+            item = before(item)
+            if item is SKIP:
+                continue
+            result = after(item)
+            if result is not SKIP:
+                yield key, [value], position, result
+    return list(islice(candidates(), n))
+
+
+def in_order(source, before, order):
+    """Returns whether the source is in the order of the QuerySet
+
+    That's the case if the QuerySet is ordered by a single field, the
+    source is in order of the field (see ``ChunkedSource.ordered_by``)
+    and only filters are applied to the items before ordering.
+
+    """
+    if not seekable(before, order):
+        return False
+    field, _ = order.orders[0]
+    return getattr(source, 'ordered_by', None) == field
+
+
+def seek_ordered(source, before, order, after, values, position, n):
+    """Finds the first n results after the cursor in a source that's
+    in order of the order field
+
+    The positions to start from are found by binary search, so only
+    the items on the page (and the ones filtered out in between) are
+    read.
+
+    :rtype: (list) of (key, values, position, result) 4 tuples
+
+    """
+    field, descending = order.orders[0]
+    size = len(source)
+
+    def key_at(p):
+        for item in source.items_at([p]):
+            return value_key(dunder_get(item, field))
+
+    def first(lo, hi, pred):
+        # first position in [lo, hi) for which pred is true, given that
+        # it's false for the positions before it
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if pred(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def forwards():
+        start = 0
+        if values is not None:
+            cursor = (value_key(values[0]), position)
+            start = first(0, size, lambda p: (key_at(p), p) > cursor)
+        return range(start, size)
+
+    def backwards():
+        # items having equal values are in order of their positions
+        # even if the order is descending, so the source is read
+        # backwards one run of equal values at a time
+        stop = size
+        if values is not None:
+            k = value_key(values[0])
+            end = first(0, size, lambda p: key_at(p) > k)
+            stop = first(0, end, lambda p: key_at(p) >= k)
+            for p in range(max(position + 1, stop), end):
+                yield p
+        while stop > 0:
+            k = key_at(stop - 1)
+            start = first(0, stop, lambda p: key_at(p) >= k)
+            for p in range(start, stop):
+                yield p
+            stop = start
+
+    before, after = compose(before), compose(after)
+    def candidates():
+        positions = backwards() if descending else forwards()
+        pending, to_read = tee(positions)
+        for p, item in zip(pending, source.items_at(to_read)):
+            item = before(item)
+            if item is SKIP:
+                continue
+            item_values = order.values(item)
+            result = after(item)
+            if result is not SKIP:
+                yield order.key(item_values) + (p,), item_values, p, result
+    return list(islice(candidates(), n))
+
+
+def paginate(queryset, page_size, after=None):
+    """Returns a page of the results of an ordered QuerySet
+
+    :param queryset  : QuerySet having an ``OrderStep``
+    :param page_size : (int) max number of results on the page
+    :param after     : (str) cursor of the previous page or None
+    :rtype           : ``Page``
+
+    """
+    if page_size < 1:
+        raise LookupyError('Page size must be at least 1')
+    source = queryset.source
+    if iter(source) is source:
+        raise LookupyError('Cannot paginate an iterable that can be consumed only once')
+    before, order, rest = split_steps(queryset.steps)
+    cursor = values = None
+    if after is not None:
+        cursor, values = decode_cursor(order, after)
+    # one more than the page size tells whether there's a next page
+    index = usable_index(source, before, order)
+    if index is not None:
+        found = seek(source, index, before, order, rest, cursor, values, page_size + 1)
+    elif in_order(source, before, order):
+        position = None if cursor is None else cursor[-1]
+        found = seek_ordered(source, before, order, rest, values, position, page_size + 1)
+    else:
+        found = scan(source, before, order, rest, cursor, page_size + 1)
+    page = found[:page_size]
+    next_cursor = None
+    if len(found) > page_size:
+        _, values, position, _ = page[-1]
+        next_cursor = encode_cursor(order, values, position)
+    return Page([result for _, _, _, result in page], next_cursor)
@@ -0,0 +1,256 @@
+"""
+   lookupy.sketches
+   ~~~~~~~~~~~~~~~~
+
+   This module consists of probabilistic data structures that
+   summarize many values in a small, bounded amount of memory.
+
+   All of them can be merged with others of the same kind and size,
+   so that the data can be split into partitions, summarized
+   separately (even in different processes) and the summaries
+   combined.
+
+"""
+
+import json
+import math
+import base64
+import random
+import hashlib
+
+
+def stable_hash(value, digest_size=8):
+    """Returns a hash of the value that's the same across processes
+
+    Unlike the builtin ``hash``, the result doesn't depend on the hash
+    seed of the interpreter, so it can be persisted or combined with
+    hashes computed elsewhere. Values that compare equal in Python
+    (eg. ``1``, ``1.0`` and ``True``) hash the same.
+
+    :param value       : (mixed) json serializable value
+    :param digest_size : (int) number of bytes in the hash
+    :rtype             : (int)
+
+    """
+    if isinstance(value, str):
+        data = value.encode('utf-8')
+    else:
+        if isinstance(value, bool) or (isinstance(value, float) and value.is_integer()):
+            value = int(value)
+        data = json.dumps(value, sort_keys=True, default=repr).encode('utf-8')
+        # keep non strings apart from strings having the same json
+        data = b'\x00' + data
+    digest = hashlib.blake2b(data, digest_size=digest_size).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class BloomFilter(object):
+    """A set that can tell for sure when a value is *not* in it
+
+    :param capacity : (int) expected number of values
+    :param fp_rate  : (float) acceptable rate of false positives
+
+    """
+
+    def __init__(self, capacity, fp_rate=0.01):
+        capacity = max(capacity, 1)
+        self.nbits = max(8, int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)))
+        self.nhashes = max(1, int(round(self.nbits / capacity * math.log(2))))
+        self.bits = bytearray((self.nbits + 7) // 8)
+
+    def _positions(self, value):
+        h = stable_hash(value, digest_size=16)
+        h1, h2 = h & 0xFFFFFFFFFFFFFFFF, h >> 64
+        return ((h1 + i * h2) % self.nbits for i in range(self.nhashes))
+
+    def add(self, value):
+        for p in self._positions(value):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(value))
+
+    def merge(self, other):
+        """Adds all values of another filter of the same size to this one"""
+        if (self.nbits, self.nhashes) != (other.nbits, other.nhashes):
+            raise ValueError('Bloom filters of different sizes cannot be merged')
+        for i, b in enumerate(other.bits):
+            self.bits[i] |= b
+
+    def to_dict(self):
+        return {'nbits': self.nbits,
+                'nhashes': self.nhashes,
+                'bits': base64.b64encode(bytes(self.bits)).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, d):
+        bf = cls.__new__(cls)
+        bf.nbits = d['nbits']
+        bf.nhashes = d['nhashes']
+        bf.bits = bytearray(base64.b64decode(d['bits']))
+        return bf
+
+
+class HyperLogLog(object):
+    """Estimates the number of distinct values
+
+    The standard error of the estimate is about ``1.04 / sqrt(2 **
+    precision)`` ie. ~0.8% for the default precision, using ``2 **
+    precision`` bytes of memory.
+
+    :param precision : (int) between 4 and 18
+
+    """
+
+    def __init__(self, precision=14):
+        if not 4 <= precision <= 18:
+            raise ValueError('Precision must be between 4 and 18')
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        h = stable_hash(value)
+        bits = 64 - self.precision
+        index = h >> bits
+        rest = h & ((1 << bits) - 1)
+        rank = bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if self.precision != other.precision:
+            raise ValueError('HyperLogLogs of different precisions cannot be merged')
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self):
+        """Returns the estimated number of distinct values added"""
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+
+class QuantileSketch(object):
+    """Estimates quantiles of a stream of values (KLL sketch)
+
+    Values are added to a hierarchy of compactors. When a compactor is
+    full, its values are sorted and every other one of them is promoted
+    to the next level where it stands for twice as many values. The
+    memory used is bounded by about ``3 * k`` values and the rank
+    error of the estimates is about ``1.7 / k``.
+
+    :param k    : (int) accuracy parameter
+    :param seed : seed for choosing which values are promoted
+
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.levels = [[]]
+        self.count = 0
+        self._random = random.Random(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * (2.0 / 3) ** depth)))
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) >= self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append([])
+                values = sorted(self.levels[level])
+                # an odd value out stays at the current level
+                keep = [values.pop()] if len(values) % 2 else []
+                offset = self._random.randint(0, 1)
+                self.levels[level + 1].extend(values[offset::2])
+                self.levels[level] = keep
+            level += 1
+
+    def add(self, value):
+        self.levels[0].append(value)
+        self.count += 1
+        if len(self.levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, values in enumerate(other.levels):
+            self.levels[level].extend(values)
+        self.count += other.count
+        self._compress()
+
+    def quantiles(self, qs):
+        """Returns the estimated values at the specified quantiles
+
+        :param qs : (list) of quantiles between 0 and 1
+        :rtype    : (list) of values, None for each if nothing was
+                    added
+
+        """
+        weighted = sorted((v, 1 << level)
+                          for level, values in enumerate(self.levels)
+                          for v in values)
+        if not weighted:
+            return [None for q in qs]
+        total = sum(w for _, w in weighted)
+        result = []
+        for q in qs:
+            target, seen = q * total, 0
+            for v, w in weighted:
+                seen += w
+                if seen >= target:
+                    break
+            result.append(v)
+        return result
+
+
+class ReservoirSample(object):
+    """Keeps a uniform random sample of a fixed size of a stream
+
+    :param size : (int) max number of values in the sample
+    :param seed : seed for the random choices
+
+    """
+
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.count = 0
+        self.values = []
+        self._random = random.Random(seed)
+
+    def add(self, value):
+        self.count += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            i = self._random.randrange(self.count)
+            if i < self.size:
+                self.values[i] = value
+
+    def merge(self, other):
+        """Merges a sample of another (disjoint) stream
+
+        The result is a uniform sample of both streams combined.
+
+        """
+        mine, theirs = list(self.values), list(other.values)
+        left, right = self.count, other.count
+        values = []
+        while len(values) < self.size and (mine or theirs):
+            # pick from either sample in proportion to the number of
+            # values it stands for
+            if theirs and (not mine or self._random.random() * (left + right) >= left):
+                values.append(theirs.pop(self._random.randrange(len(theirs))))
+                right -= 1
+            else:
+                values.append(mine.pop(self._random.randrange(len(mine))))
+                left -= 1
+        self.values = values
+        self.count += other.count
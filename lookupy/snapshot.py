@@ -0,0 +1,270 @@
+"""
+   lookupy.snapshot
+   ~~~~~~~~~~~~~~~~
+
+   This module deals with saving collections to a compact binary file
+   that can be loaded again without parsing it. Loading a snapshot
+   only memory maps the file; items are decoded one at a time as and
+   when they are accessed.
+
+   Layout of a snapshot file (all ints little endian)::
+
+       magic      : b'LKPYSNP1'
+       records    : for each item, length (I) + encoded item
+       strings    : utf-8 encoded strings, one after the other
+       string dir : for each string, offset (Q) + length (I)
+       record dir : for each item, offset (Q)
+       indexes    : for each index, name length (I) + name + index
+                    segment (see ``lookupy.index``) mapping values to
+                    item numbers
+       index dir  : for each index, offset (Q)
+       footer     : see ``_footer`` + magic
+
+   All strings (keys as well as values) are stored only once in the
+   string table and referred to by their number in the items.
+
+"""
+
+import os
+import mmap
+import struct
+import tempfile
+
+from .lookupy import LookupyError
+from .dunderkey import dunder_get
+from .index import MappedIndex, build_postings, write_index
+from .sources import Source
+
+
+MAGIC = b'LKPYSNP1'
+
+# offset and count of the strings, the records and the indexes
+_footer = struct.Struct('<QQQQQQ')
+_u32 = struct.Struct('<I')
+_u64 = struct.Struct('<Q')
+_i64 = struct.Struct('<q')
+_f64 = struct.Struct('<d')
+_string_entry = struct.Struct('<QI')
+
+# tags of the encoded values
+T_NONE = b'N'
+T_TRUE = b'T'
+T_FALSE = b'F'
+T_INT = b'i'
+T_BIGINT = b'I'
+T_FLOAT = b'd'
+T_STR = b's'
+T_LIST = b'l'
+T_DICT = b'm'
+
+
+class _Encoder(object):
+
+    def __init__(self):
+        self.strings = {}
+
+    def string_id(self, s):
+        try:
+            return self.strings[s]
+        except KeyError:
+            i = self.strings[s] = len(self.strings)
+            return i
+
+    def encode(self, value, out):
+        if value is None:
+            out.append(T_NONE)
+        elif value is True:
+            out.append(T_TRUE)
+        elif value is False:
+            out.append(T_FALSE)
+        elif isinstance(value, int):
+            if -(1 << 63) <= value < (1 << 63):
+                out.append(T_INT + _i64.pack(value))
+            else:
+                out.append(T_BIGINT + _u32.pack(self.string_id(str(value))))
+        elif isinstance(value, float):
+            out.append(T_FLOAT + _f64.pack(value))
+        elif isinstance(value, str):
+            out.append(T_STR + _u32.pack(self.string_id(value)))
+        elif isinstance(value, (list, tuple)):
+            out.append(T_LIST + _u32.pack(len(value)))
+            for v in value:
+                self.encode(v, out)
+        elif hasattr(value, 'keys'):
+            out.append(T_DICT + _u32.pack(len(value)))
+            for k in value.keys():
+                if not isinstance(k, str):
+                    raise LookupyError('Cannot save key {k!r}, keys must be strings'.format(k=k))
+                out.append(_u32.pack(self.string_id(k)))
+                self.encode(value[k], out)
+        else:
+            raise LookupyError('Cannot save value of type {t}'.format(t=type(value).__name__))
+
+
+def save(items, path, indexes=()):
+    """Saves items to a snapshot file
+
+    :param items   : iterable of dicts
+    :param path    : path of the file to write
+    :param indexes : dunder keys of the fields to index
+
+    """
+    # written to a temporary file first so that the file isn't
+    # truncated while it may be memory mapped (eg. when saving the
+    # results of a query over the same snapshot) and an interrupted
+    # save doesn't leave a partial snapshot behind
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            _write(items, f, indexes)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _write(items, f, indexes):
+    encoder = _Encoder()
+    record_offsets = []
+    pairs = dict((field, []) for field in indexes)
+    f.write(MAGIC)
+    offset = len(MAGIC)
+    for i, item in enumerate(items):
+        out = []
+        encoder.encode(item, out)
+        data = b''.join(out)
+        f.write(_u32.pack(len(data)))
+        f.write(data)
+        record_offsets.append(offset)
+        offset += _u32.size + len(data)
+        for field, p in pairs.items():
+            p.append((i, dunder_get(item, field)))
+
+    string_dir = []
+    for s in sorted(encoder.strings, key=encoder.strings.get):
+        data = s.encode('utf-8')
+        f.write(data)
+        string_dir.append(_string_entry.pack(offset, len(data)))
+        offset += len(data)
+    strings_offset = offset
+    f.write(b''.join(string_dir))
+    offset += _string_entry.size * len(string_dir)
+
+    records_offset = offset
+    f.write(b''.join(_u64.pack(o) for o in record_offsets))
+    offset += _u64.size * len(record_offsets)
+
+    index_offsets = []
+    for field in indexes:
+        index_offsets.append(offset)
+        name = field.encode('utf-8')
+        f.write(_u32.pack(len(name)))
+        f.write(name)
+        postings, others = build_postings(pairs.pop(field))
+        offset += _u32.size + len(name) + write_index(f, postings, others)
+    indexes_offset = offset
+    f.write(b''.join(_u64.pack(o) for o in index_offsets))
+
+    f.write(_footer.pack(strings_offset, len(string_dir),
+                         records_offset, len(record_offsets),
+                         indexes_offset, len(index_offsets)))
+    f.write(MAGIC)
+
+
+class SnapshotSource(Source):
+    """Source for a snapshot file saved using ``save``
+
+    Items are decoded lazily, one at a time. Filters on indexed fields
+    decode only the items that may match.
+
+    :param path: path of the snapshot file
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        end = len(self.buf) - len(MAGIC)
+        if self.buf[:len(MAGIC)] != MAGIC or self.buf[end:] != MAGIC:
+            raise LookupyError('Not a snapshot file: {path}'.format(path=path))
+        (self._strings_offset, nstrings,
+         self._records_offset, self.nrecords,
+         indexes_offset, nindexes) = _footer.unpack_from(self.buf, end - _footer.size)
+        self._strings = [None] * nstrings
+        self.indexes = {}
+        for i in range(nindexes):
+            (offset,) = _u64.unpack_from(self.buf, indexes_offset + _u64.size * i)
+            (name_len,) = _u32.unpack_from(self.buf, offset)
+            start = offset + _u32.size
+            field = self.buf[start:start+name_len].decode('utf-8')
+            self.indexes[field] = MappedIndex(self.buf, start + name_len)
+
+    def __len__(self):
+        return self.nrecords
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.nrecords:
+            raise IndexError(i)
+        (offset,) = _u64.unpack_from(self.buf, self._records_offset + _u64.size * i)
+        value, _ = self._decode(offset + _u32.size)
+        return value
+
+    def __iter__(self):
+        for i in range(self.nrecords):
+            yield self[i]
+
+    def string(self, i):
+        s = self._strings[i]
+        if s is None:
+            offset, length = _string_entry.unpack_from(self.buf, self._strings_offset + _string_entry.size * i)
+            s = self._strings[i] = self.buf[offset:offset+length].decode('utf-8')
+        return s
+
+    def _decode(self, pos):
+        buf = self.buf
+        tag = buf[pos:pos+1]
+        pos += 1
+        if tag == T_STR:
+            return self.string(_u32.unpack_from(buf, pos)[0]), pos + 4
+        if tag == T_INT:
+            return _i64.unpack_from(buf, pos)[0], pos + 8
+        if tag == T_DICT:
+            (n,) = _u32.unpack_from(buf, pos)
+            pos += 4
+            result = {}
+            for _ in range(n):
+                key = self.string(_u32.unpack_from(buf, pos)[0])
+                result[key], pos = self._decode(pos + 4)
+            return result, pos
+        if tag == T_LIST:
+            (n,) = _u32.unpack_from(buf, pos)
+            pos += 4
+            result = []
+            for _ in range(n):
+                value, pos = self._decode(pos)
+                result.append(value)
+            return result, pos
+        if tag == T_NONE:
+            return None, pos
+        if tag == T_TRUE:
+            return True, pos
+        if tag == T_FALSE:
+            return False, pos
+        if tag == T_FLOAT:
+            return _f64.unpack_from(buf, pos)[0], pos + 8
+        if tag == T_BIGINT:
+            return int(self.string(_u32.unpack_from(buf, pos)[0])), pos + 4
+        raise LookupyError('Corrupt snapshot file: {path}'.format(path=self.path))
+
+    def items_at(self, positions):
+        return (self[i] for i in positions)
+
+    def candidates(self, lookup_groups):
+        positions = self.index_positions(lookup_groups)
+        items = iter(self) if positions is None else self.items_at(sorted(positions))
+        for item in items:
+            yield item
+
+    def close(self):
+        self.buf.close()
@@ -0,0 +1,646 @@
+"""
+   lookupy.sources
+   ~~~~~~~~~~~~~~~
+
+   This module provides data sources other than in memory lists that
+   can be wrapped by a Collection eg::
+
+       >>> c = Collection(JsonlSource('entries.jsonl'))
+
+   Sources are iterables of dicts but unlike plain iterables they may
+   also rule out items that can't match a filter without reading them
+   (see ``Source.candidates``).
+
+"""
+
+import os
+import bz2
+import glob
+import gzip
+import json
+import lzma
+import mmap
+import queue
+import struct
+import tempfile
+import threading
+from bisect import bisect_left, bisect_right
+from itertools import chain
+
+from .lookupy import conjunctive_lookups, batches, LookupyError
+from .dunderkey import dunder_get
+from .index import MappedIndex, build_postings, write_index, value_kind, value_key
+from .zonemap import FieldSummary, summarize, may_match
+from .compact import Compactor
+from .dates import epoch_bounds, to_epoch
+
+
+INDEX_MAGIC = b'LKPYIDX1'
+
+# source size, source mtime (ns) and length of the field name
+_index_file_header = struct.Struct('<QQI')
+
+
+# magic bytes at the start of compressed files
+COMPRESSIONS = ((b'\x1f\x8b', 'gzip', gzip.open),
+                (b'BZh', 'bz2', bz2.open),
+                (b'\xfd7zXZ\x00', 'xz', lzma.open))
+
+
+def detect_compression(path):
+    """Detects the format a file is compressed in
+
+    :param path : path to the file
+    :rtype      : (str) one of 'gzip', 'bz2', 'xz' or None if the file
+                  isn't compressed
+
+    """
+    with open(path, 'rb') as f:
+        head = f.read(6)
+    for magic, name, _ in COMPRESSIONS:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def open_file(path):
+    """Opens a file for reading bytes, decompressing it if required"""
+    compression = detect_compression(path)
+    for _, name, opener in COMPRESSIONS:
+        if name == compression:
+            return opener(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_ahead(items, size=4, batch_size=256):
+    """Consumes an iterable in a background thread
+
+    Items are handed over in batches through a bounded queue, so that
+    reading (and decompressing and parsing) the next items overlaps
+    with the processing of the current ones while holding only a
+    bounded number of items in memory. Errors raised in the background
+    thread are raised again when the items are consumed.
+
+    :param items      : iterable
+    :param size       : (int) max number of batches in the queue
+    :param batch_size : (int) number of items per batch
+    :rtype            : lazy iterable
+
+    """
+    q = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+
+    def put(msg):
+        while not stopped.is_set():
+            try:
+                q.put(msg, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for batch in batches(items, batch_size):
+                if not put(('batch', batch)):
+                    return
+            put(('done', None))
+        except Exception as e:
+            put(('error', e))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            kind, payload = q.get()
+            if kind == 'batch':
+                for item in payload:
+                    yield item
+            elif kind == 'error':
+                raise payload
+            else:
+                break
+    finally:
+        # lets the thread exit if the items aren't consumed fully
+        stopped.set()
+
+
+class Source(object):
+    """Base class for all sources"""
+
+    # indexes of the source, mapping dunder keys of fields to
+    # ``MappedIndex`` objects
+    indexes = {}
+
+    def __iter__(self):
+        raise NotImplementedError
+
+    def index_positions(self, lookup_groups):
+        """Finds the positions of the items that may match using indexes
+
+        :param lookup_groups : (list) of ``Q`` objects
+        :rtype               : (set) of positions or None if none of
+                               the lookups can be answered by indexes
+
+        """
+        positions = None
+        for field, op, val in conjunctive_lookups(lookup_groups):
+            index = self.indexes.get(field)
+            found = None if index is None else index.positions(op, val)
+            if found is not None:
+                positions = set(found) if positions is None else positions.intersection(found)
+        return positions
+
+    def candidates(self, lookup_groups):
+        """Returns the items that may match the lookup groups
+
+        The items are returned in the same order as iterating over the
+        source would. Subclasses override this to skip items that
+        definitely don't match; the lookups are still evaluated for the
+        returned items.
+
+        :param lookup_groups : (list) of ``Q`` objects
+        :rtype               : lazy iterable
+
+        """
+        return iter(self)
+
+    def positioned(self):
+        """Yields the items along with their positions
+
+        Positions identify items in the source and increase in the
+        order of iteration. They are what indexes map values to.
+
+        :rtype: lazy iterable of (position, item) 2 tuples
+
+        """
+        return enumerate(self)
+
+    def items_at(self, positions):
+        """Yields the items at the specified positions
+
+        :param positions : iterable of positions as yielded by
+                           ``positioned``
+        :rtype           : lazy iterable
+
+        """
+        raise NotImplementedError
+
+
+class ChunkedSource(Source):
+    """Source consisting of chunks of items held in memory
+
+    A zone map is maintained for every chunk so that chunks in which
+    no item can match a filter are skipped altogether.
+
+    If a time field is specified, its timestamps are converted to
+    seconds since the epoch once, when the chunks are created. Filters
+    comparing the field with dates or datetimes (eg. ``__gte``,
+    ``__range``, ``__date``) then skip the chunks outside the time
+    window and, within chunks that are in time order (eg. logs),
+    binary search for the items in the window instead of parsing the
+    timestamps of every item. If all the items are in order of the
+    time field, ``ordered_by`` is set to it, which lets QuerySets
+    ordered by the field seek to the cursors of pages (see
+    ``lookupy.paginate``).
+
+    :param chunks     : iterable of lists of dicts
+    :param fields     : dunder keys of the fields to summarize
+    :param time_field : (str) dunder key of the timestamp field
+
+    """
+
+    def __init__(self, chunks, fields=(), time_field=None):
+        self.chunks = [list(c) for c in chunks]
+        self.fields = tuple(fields)
+        self.zone_maps = [summarize(c, self.fields) for c in self.chunks]
+        self.time_field = time_field
+        self.epochs = None
+        # positions of the first items of the chunks followed by the
+        # number of items
+        self._starts = [0]
+        for c in self.chunks:
+            self._starts.append(self._starts[-1] + len(c))
+        # field that the items are in order of (by ``value_key``)
+        self.ordered_by = None
+        if time_field is not None:
+            self.epochs = [[to_epoch(dunder_get(item, time_field)) for item in c]
+                           for c in self.chunks]
+            self._epoch_ranges = [self._epoch_range(e) for e in self.epochs]
+            if self._in_order(time_field):
+                self.ordered_by = time_field
+
+    @classmethod
+    def from_items(cls, items, chunk_size=10000, fields=(), time_field=None):
+        """Splits an iterable of items into chunks of the specified size"""
+        return cls(batches(items, chunk_size), fields, time_field)
+
+    def __iter__(self):
+        return chain.from_iterable(self.chunks)
+
+    def __len__(self):
+        return self._starts[-1]
+
+    def items_at(self, positions):
+        for position in positions:
+            i = bisect_right(self._starts, position) - 1
+            yield self.chunks[i][position - self._starts[i]]
+
+    def _in_order(self, field):
+        # whether the values of the field can all be ordered and are
+        # in order
+        prev = None
+        for item in self:
+            value = dunder_get(item, field)
+            if value_kind(value) is None:
+                return False
+            key = value_key(value)
+            if prev is not None and key < prev:
+                return False
+            prev = key
+        return True
+
+    @staticmethod
+    def _epoch_range(epochs):
+        # min and max timestamps of a chunk and whether it's in time
+        # order (in which case none of the timestamps are missing)
+        known = [e for e in epochs if e is not None]
+        if not known:
+            return None, None, False
+        ordered = len(known) == len(epochs) and all(a <= b for a, b in zip(epochs, epochs[1:]))
+        return min(known), max(known), ordered
+
+    def time_window(self, lookup_groups):
+        """Finds the range of timestamps of the items that may match
+
+        :param lookup_groups : (list) of ``Q`` objects
+        :rtype               : (tuple) of min and max seconds since the
+                               epoch or None if the lookup groups don't
+                               restrict the time field
+
+        """
+        window = None
+        if self.time_field is None:
+            return window
+        for field, op, val in conjunctive_lookups(lookup_groups):
+            bounds = epoch_bounds(op, val) if field == self.time_field else None
+            if bounds is not None:
+                window = bounds if window is None else (max(window[0], bounds[0]),
+                                                        min(window[1], bounds[1]))
+        return window
+
+    def candidates(self, lookup_groups):
+        window = self.time_window(lookup_groups)
+        for i, (chunk, zone_map) in enumerate(zip(self.chunks, self.zone_maps)):
+            if not may_match(zone_map, lookup_groups):
+                continue
+            if window is None:
+                for item in chunk:
+                    yield item
+                continue
+            lo, hi = window
+            epochs = self.epochs[i]
+            first, last, ordered = self._epoch_ranges[i]
+            # items without a timestamp never satisfy a lookup on it
+            if first is None or last < lo or first > hi:
+                continue
+            if ordered:
+                start, stop = bisect_left(epochs, lo), bisect_right(epochs, hi)
+                for item in chunk[start:stop]:
+                    yield item
+            else:
+                for item, epoch in zip(chunk, epochs):
+                    if epoch is not None and lo <= epoch <= hi:
+                        yield item
+
+
+class JsonSource(Source):
+    """Source for a file containing a single json document eg. a HAR
+    file
+
+    The whole document is parsed every time the items are iterated
+    over.
+
+    :param path      : path to the json file, optionally compressed
+                       using gzip, bz2 or xz
+    :param key       : (str) dunder key of the list of items in the
+                       document. By default, it's the document itself if
+                       it's a list or the entries if it's a HAR file
+    :param compact   : (boolean) load items as compact records
+    :param intern    : (boolean) intern the keys and strings of the
+                       loaded items, implied by compact
+    :param readahead : (int) if non zero, the file is read and parsed
+                       in a background thread
+
+    """
+
+    def __init__(self, path, key=None, compact=False, intern=False, readahead=0):
+        self.path = path
+        self.key = key
+        self.compactor = Compactor(compact) if compact or intern else None
+        self.readahead = readahead
+
+    def __iter__(self):
+        items = self.items()
+        if self.readahead:
+            items = read_ahead(items, self.readahead)
+        for item in items:
+            yield item
+
+    def items(self):
+        with open_file(self.path) as f:
+            data = f.read().decode('utf-8')
+        if self.compactor is None:
+            doc = json.loads(data)
+        else:
+            doc = json.loads(data, object_pairs_hook=self.compactor.from_pairs)
+        if self.key is not None:
+            items = dunder_get(doc, self.key)
+        elif hasattr(doc, 'keys'):
+            items = dunder_get(doc, 'log__entries')
+        else:
+            items = doc
+        if not isinstance(items, list):
+            raise LookupyError('No list of items found in {path}'.format(path=self.path))
+        for item in items:
+            yield item
+
+
+class JsonlSource(Source):
+    """Source for a file containing one json object per line
+
+    Indexes created for fields of the items using ``create_index``
+    are saved alongside the file (as ``<path>.<field>.lkidx``) and
+    are memory mapped when the source is opened again, so that filters
+    on the indexed fields can read only the matching lines. Similarly,
+    zone maps created using ``create_zone_maps`` (saved as
+    ``<path>.lkzm``) allow skipping chunks of lines that can't
+    match. Both are ignored once the file is modified.
+
+    Files compressed using gzip, bz2 or xz are detected and
+    decompressed on the fly, although without support for indexes and
+    zone maps since they can't be read from arbitrary offsets.
+
+    :param path      : path to the jsonl file
+    :param compact   : (boolean) load items as compact records (see
+                       ``lookupy.compact``)
+    :param intern    : (boolean) intern the keys and strings of the
+                       loaded items, implied by compact
+    :param readahead : (int) if non zero, the file is read, decompressed
+                       and parsed in a background thread keeping up to
+                       these many batches of items ready
+
+    """
+
+    def __init__(self, path, compact=False, intern=False, readahead=0):
+        self.path = path
+        self.compactor = Compactor(compact) if compact or intern else None
+        self.readahead = readahead
+        self.indexes = {}
+        # size and mtime of the file when the indexes and the zone maps
+        # were loaded
+        self._indexes_fingerprint = None
+        self.zone_maps = []
+        self._zone_maps_fingerprint = None
+        if not os.path.exists(path):
+            raise LookupyError('No such file: {path}'.format(path=path))
+        self.compression = detect_compression(path)
+        if self.compression is None:
+            self.load_indexes()
+            self.load_zone_maps()
+
+    def __iter__(self):
+        items = (item for _, item in self.records())
+        if self.readahead:
+            items = read_ahead(items, self.readahead)
+        for item in items:
+            yield item
+
+    def loads(self, line):
+        """Parses a line of the file into an item"""
+        if self.compactor is None:
+            return json.loads(line.decode('utf-8'))
+        return json.loads(line.decode('utf-8'), object_pairs_hook=self.compactor.from_pairs)
+
+    def records(self):
+        """Yields items along with their byte offsets in the file
+
+        :rtype: lazy iterable of (offset, item) 2 tuples
+
+        """
+        with open_file(self.path) as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    yield offset, self.loads(line)
+                offset += len(line)
+
+    def read_range(self, start, end):
+        """Yields items in the lines between two byte offsets
+
+        :param start : (int) offset of the first line
+        :param end   : (int) offset after the last line
+        :rtype       : lazy iterable
+
+        """
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            offset = start
+            while offset < end:
+                line = f.readline()
+                if not line:
+                    break
+                if line.strip():
+                    yield self.loads(line)
+                offset += len(line)
+
+    def read_at(self, offsets):
+        """Yields items starting at the specified byte offsets
+
+        :param offsets : iterable of (int) offsets
+        :rtype         : lazy iterable
+
+        """
+        with open(self.path, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                yield self.loads(f.readline())
+
+    def positioned(self):
+        return self.records()
+
+    def items_at(self, positions):
+        return self.read_at(positions)
+
+    def candidates(self, lookup_groups):
+        self.drop_stale()
+        positions = self.index_positions(lookup_groups)
+        if positions is not None:
+            items = self.read_at(sorted(positions))
+        elif self.zone_maps:
+            items = chain.from_iterable(self.read_range(start, end)
+                                        for start, end, zone_map in self.zone_maps
+                                        if may_match(zone_map, lookup_groups))
+        else:
+            items = iter(self)
+        for item in items:
+            yield item
+
+    ## indexes
+
+    def index_path(self, field):
+        return '{path}.{field}.lkidx'.format(path=self.path, field=field)
+
+    def _guard_uncompressed(self):
+        if self.compression is not None:
+            raise LookupyError('Cannot index a file compressed using {c}'.format(c=self.compression))
+
+    def _fingerprint(self):
+        st = os.stat(self.path)
+        return st.st_size, st.st_mtime_ns
+
+    def create_index(self, *fields):
+        """Creates (or recreates) indexes for the specified fields
+
+        The whole file is read only once irrespective of the number of
+        fields.
+
+        :param fields : dunder keys of the fields to index
+
+        """
+        self._guard_uncompressed()
+        pairs = dict((f, []) for f in fields)
+        for offset, item in self.records():
+            for f in fields:
+                pairs[f].append((offset, dunder_get(item, f)))
+        size, mtime = self._fingerprint()
+        for f in fields:
+            postings, others = build_postings(pairs.pop(f))
+            name = f.encode('utf-8')
+            path = self.index_path(f)
+            # written to a temporary file first so that an interrupted
+            # write doesn't leave a partial index behind
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as fp:
+                    fp.write(INDEX_MAGIC)
+                    fp.write(_index_file_header.pack(size, mtime, len(name)))
+                    fp.write(name)
+                    write_index(fp, postings, others)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        self.load_indexes()
+
+    def load_indexes(self):
+        """Memory maps all the up to date index files of the source"""
+        self.indexes = {}
+        fingerprint = self._fingerprint()
+        self._indexes_fingerprint = fingerprint
+        for p in glob.glob(glob.escape(self.path) + '.*.lkidx'):
+            try:
+                with open(p, 'rb') as f:
+                    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (IOError, ValueError):
+                # eg. empty files can't be memory mapped
+                continue
+            try:
+                field, index = self._read_index(buf, fingerprint)
+            except (ValueError, struct.error):
+                # invalid or truncated index files are ignored
+                field = None
+            if field is None:
+                buf.close()
+            else:
+                self.indexes[field] = index
+
+    def drop_stale(self):
+        """Drops the indexes and the zone maps if the file was modified
+        since they were loaded
+
+        This is checked every time they may be used, so that a source
+        that's kept open doesn't read the file at the offsets of an
+        older version of it or skip lines appended to it.
+
+        """
+        if not self.indexes and not self.zone_maps:
+            return
+        fingerprint = self._fingerprint()
+        if fingerprint != self._indexes_fingerprint:
+            self.indexes = {}
+        if fingerprint != self._zone_maps_fingerprint:
+            self.zone_maps = []
+
+    @staticmethod
+    def _read_index(buf, fingerprint):
+        # returns the field and the index in an index file or None if
+        # the index is stale
+        start = len(INDEX_MAGIC)
+        if buf[:start] != INDEX_MAGIC:
+            raise ValueError('Not an index file')
+        size, mtime, name_len = _index_file_header.unpack_from(buf, start)
+        if (size, mtime) != fingerprint:
+            return None, None
+        start += _index_file_header.size
+        field = buf[start:start+name_len].decode('utf-8')
+        return field, MappedIndex(buf, start + name_len)
+
+    ## zone maps
+
+    def zone_map_path(self):
+        return '{path}.lkzm'.format(path=self.path)
+
+    def create_zone_maps(self, fields, chunk_size=10000, fp_rate=0.01):
+        """Creates (or recreates) the zone maps of the file
+
+        :param fields     : dunder keys of the fields to summarize
+        :param chunk_size : (int) number of lines per chunk
+        :param fp_rate    : (float) false positive rate of the Bloom
+                            filters for string values
+
+        """
+        self._guard_uncompressed()
+        size, mtime = self._fingerprint()
+        chunks = []
+        def flush(start, end, items):
+            zone_map = summarize(items, fields, fp_rate)
+            chunks.append({'start': start,
+                           'end': end,
+                           'fields': dict((f, s.to_dict()) for f, s in zone_map.items())})
+        start, items = 0, []
+        for offset, item in self.records():
+            if len(items) == chunk_size:
+                flush(start, offset, items)
+                start, items = offset, []
+            items.append(item)
+        if items:
+            flush(start, size, items)
+        path = self.zone_map_path()
+        # written to a temporary file first like the indexes
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'size': size, 'mtime': mtime, 'chunks': chunks}, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.load_zone_maps()
+
+    def load_zone_maps(self):
+        """Loads the zone maps of the file if they are up to date"""
+        self.zone_maps = []
+        try:
+            with open(self.zone_map_path()) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return
+        fingerprint = self._fingerprint()
+        if (data['size'], data['mtime']) != fingerprint:
+            return
+        self._zone_maps_fingerprint = fingerprint
+        self.zone_maps = [(c['start'], c['end'],
+                           dict((k, FieldSummary.from_dict(v)) for k, v in c['fields'].items()))
+                          for c in data['chunks']]
@@ -0,0 +1,198 @@
+"""
+   lookupy.specialize
+   ~~~~~~~~~~~~~~~~~~
+
+   This module deals with generating Python code specialized for the
+   lookups of a query and the schema of the data.
+
+   When most items share the same schema (eg. HAR entries), the values
+   of the fields can be accessed directly (``item['request']['url']``)
+   and the lookups reduced to plain expressions (``v0 >= 500``)
+   instead of going through ``dunder_get`` and the generic lookup
+   functions. Every item is first checked against the schema (the
+   shape guard) and items that don't match are evaluated using the
+   generic lookups, so the results are the same either way.
+
+"""
+
+import re
+from itertools import islice
+from collections.abc import Mapping
+
+from .lookupy import LookupLeaf, parse_lookup, compile_lookup, frozen_members
+from .dates import is_datetime
+from .expressions import Expression
+
+
+# types for which lookups can be specialized
+SCALAR_TYPES = (bool, int, float, str)
+
+
+def infer_schema(items, fields):
+    """Infers the types of fields from a sample of items
+
+    A field is part of the schema only if it's present in all the
+    sampled items, all the containers on the way to it are dicts (or
+    other mappings) and its value has the same scalar type.
+
+    :param items  : iterable of sampled items
+    :param fields : dunder keys of the fields
+    :rtype        : (dict) mapping fields to types
+
+    """
+    types = dict((f, set()) for f in fields)
+    for item in items:
+        for field in fields:
+            value = item
+            for part in field.split('__'):
+                if not isinstance(value, Mapping) or part not in value:
+                    # missing fields don't have a type
+                    types[field].add(None)
+                    break
+                value = value[part]
+            else:
+                types[field].add(type(value))
+    schema = {}
+    for field, ts in types.items():
+        if len(ts) == 1:
+            t = ts.pop()
+            if t in SCALAR_TYPES:
+                schema[field] = t
+    return schema
+
+
+def iter_leaves(lookup_groups):
+    """Yields all the leaves of lookup trees irrespective of the
+    operators and negations"""
+    for lg in lookup_groups:
+        if isinstance(lg, LookupLeaf):
+            yield lg
+        else:
+            for leaf in iter_leaves(lg.children):
+                yield leaf
+
+
+# templates of expressions for lookups on a value ``v`` and a constant
+# ``c`` of the specified types
+_string_ops = {'contains': '{c} in {v}',
+               'icontains': '{c} in {v}.lower()',
+               'startswith': '{v}.startswith({c})',
+               'istartswith': '{v}.lower().startswith({c})',
+               'endswith': '{v}.endswith({c})',
+               'iendswith': '{v}.lower().endswith({c})',
+               'regex': '{c}.search({v}) is not None'}
+
+_comparison_ops = {'exact': '{v} == {c}',
+                   'neq': '{v} != {c}',
+                   'in': '{v} in {c}',
+                   'gt': '{v} > {c}',
+                   'gte': '{v} >= {c}',
+                   'lt': '{v} < {c}',
+                   'lte': '{v} <= {c}'}
+
+
+def _constant(op, val):
+    # the value as it's used by the generic lookup
+    if op in ('icontains', 'istartswith', 'iendswith'):
+        return val.lower()
+    if op == 'regex':
+        return re.compile(val)
+    if op == 'in':
+        members = frozen_members(val)
+        return val if members is None else members
+    return val
+
+
+class _Generator(object):
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.namespace = {}
+        self.fields = {}
+
+    def name(self, prefix, value):
+        name = '{p}{i}'.format(p=prefix, i=len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def var(self, field):
+        if field not in self.fields:
+            self.fields[field] = 'v{i}'.format(i=len(self.fields))
+        return self.fields[field]
+
+    def lookup(self, key, val):
+        # compiling the generic lookup first validates the value just
+        # like it would be otherwise
+        generic = compile_lookup(key, val)
+        field, op = parse_lookup(key)
+        typ = self.schema.get(field)
+        if typ is str and op in _string_ops:
+            template = _string_ops[op]
+        # timestamps compared with datetimes need to be parsed first,
+        # expressions are evaluated for each item and other iterables
+        # (eg. subqueries) are consumed only once
+        elif typ is not None and op in _comparison_ops and not is_datetime(val) \
+             and not isinstance(val, Expression) \
+             and (op != 'in' or isinstance(val, (str, list, tuple, set, frozenset))):
+            template = _comparison_ops[op]
+        else:
+            return '{g}(item)'.format(g=self.name('_g', generic))
+        return template.format(v=self.var(field), c=self.name('_c', _constant(op, val)))
+
+    def tree(self, elem):
+        if isinstance(elem, LookupLeaf):
+            exprs = [self.lookup(k, v) for k, v in elem.lookups.items()]
+            expr = '(' + ' and '.join(exprs) + ')' if exprs else 'True'
+        else:
+            exprs = [self.tree(c) for c in elem.children]
+            joiner = ' or ' if elem.op == 'or' else ' and '
+            expr = '(' + joiner.join(exprs) + ')' if exprs else ('False' if elem.op == 'or' else 'True')
+        return '(not {e})'.format(e=expr) if elem.negate else expr
+
+
+def specialize(lookup_groups, schema, fallback):
+    """Generates a predicate for lookup groups specialized to a schema
+
+    :param lookup_groups : (list) of ``Q`` objects
+    :param schema        : (dict) as returned by ``infer_schema``
+    :param fallback      : function that evaluates the lookup groups
+                           for items not matching the schema
+    :rtype               : function that takes an item and returns
+                           (boolean). The generated code is available
+                           as its ``source`` attribute
+
+    """
+    gen = _Generator(schema)
+    exprs = [gen.tree(lg) for lg in lookup_groups]
+    body = ' and '.join(exprs) if exprs else 'True'
+    lines = ['def predicate(item):']
+    if gen.fields:
+        lines.append('    try:')
+        for field, var in gen.fields.items():
+            access = ''.join('[{k!r}]'.format(k=k) for k in field.split('__'))
+            lines.append('        {var} = item{access}'.format(var=var, access=access))
+        lines.append('    except Exception:')
+        lines.append('        return _fallback(item)')
+        guard = ' or '.join('type({var}) is not {t}'.format(var=var, t=gen.name('_t', schema[field]))
+                            for field, var in gen.fields.items())
+        lines.append('    if {guard}:'.format(guard=guard))
+        lines.append('        return _fallback(item)')
+    lines.append('    return {body}'.format(body=body))
+    source = '\n'.join(lines) + '\n'
+    namespace = dict(gen.namespace, _fallback=fallback)
+    exec(compile(source, '<lookupy specialized predicate>', 'exec'), namespace)
+    predicate = namespace['predicate']
+    predicate.source = source
+    return predicate
+
+
+def sample_schema(items, lookup_groups, sample_size=100):
+    """Infers the schema of the fields used in lookup groups from the
+    first items of an iterable"""
+    fields = []
+    for leaf in iter_leaves(lookup_groups):
+        for key in leaf.lookups:
+            field, _ = parse_lookup(key)
+            if field not in fields:
+                fields.append(field)
+    return infer_schema(islice(items, sample_size), fields)
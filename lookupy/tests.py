@@ -9,11 +9,33 @@
 
 """
 
+import os
 import re
+import json
+import bz2
+import sys
+import gzip
+import lzma
+import shutil
+import tempfile
+from io import StringIO
+from datetime import datetime, date, timedelta, timezone
 from nose.tools import assert_list_equal, assert_equal, assert_raises
 
-from .lookupy import filter_items, lookup, include_keys, Q, QuerySet, \
-    Collection, LookupyError
+from .lookupy import filter_items, lookup, compile_lookup, include_keys, Q, \
+    QuerySet, Collection, LookupyError, SharedGetter, FilterStep
+from .sources import JsonSource, JsonlSource, ChunkedSource, read_ahead, \
+    detect_compression
+from .sketches import BloomFilter, HyperLogLog, QuantileSketch, ReservoirSample
+from .compact import CompactRecord, compact_records
+from .snapshot import SnapshotSource
+from .specialize import infer_schema, specialize
+from .aggregates import Count, Sum, Min, Max, Avg, ApproxCountDistinct, \
+    ApproxQuantiles, Sample
+from .live import LiveCollection
+from .expressions import F
+from .cli import parse_filter, main as cli_main
+from .zonemap import FieldSummary
 from .dunderkey import dunderkey, dunder_partition, dunder_init, dunder_last, \
     dunder_get, undunder_keys, dunder_truncate
 
@@ -37,6 +59,14 @@ def ik(entries, fields):
     return list(include_keys(entries, fields))
 
 
+def write_jsonl(dirname, entries, name='entries.jsonl'):
+    path = os.path.join(dirname, name)
+    with open(path, 'w') as f:
+        for e in entries:
+            f.write(json.dumps(e) + '\n')
+    return path
+
+
 ## Tests
 
 
@@ -63,6 +93,7 @@ def test_Q():
     assert not (q1 & q3).evaluate(entries[0])
     assert (q1 | q3).evaluate(entries[0])
     assert (~(q1 & q3)).evaluate(entries[0])
+    assert not (~(q1 | q3)).evaluate(entries[0])
 
     assert_list_equal(list(((Q(request__url__endswith='.jpg') | Q(response__status=404)).evaluate(e)
                       for e in entries)),
@@ -113,6 +144,10 @@ def test_lookup():
     assert not lookup('response__status__in', [], entry2)
     assert lookup('request__url__in', 'http://example.com/?q=hello', entry1)
     assert_raises(LookupyError, lookup, 'response__status__in', 404, entry1)
+    assert lookup('response__status__in', (s for s in [400, 404]), entry1)
+    # unhashable values fall back to comparing them one by one
+    assert lookup('response__headers__in', [entry1['response']['headers'], 1], entry1)
+    assert lookup('response__status__in', [[1], 404], entry1)
 
     # startswith  -- works for strings, else raises error
     assert lookup('request__url__startswith', 'http://', entry1)
@@ -199,6 +234,22 @@ def test_lookup():
     assert lookup('response_unknown', None, entry1)
 
 
+def test_compile_lookup():
+    entry1, entry2, entry3 = entries_fixtures
+    check = compile_lookup('request__url__istartswith', 'HTTP://EXAMPLE.COM/')
+    assert_list_equal([check(e) for e in entries_fixtures], [False, False, True])
+    check = compile_lookup('response__status', 200)
+    assert_list_equal([check(e) for e in entries_fixtures], [False, True, True])
+    assert_raises(LookupyError, compile_lookup, 'request__url__contains', 1)
+    # values are looked up using the getter that's passed
+    gets = []
+    def get(item, field):
+        gets.append(field)
+        return 404
+    assert compile_lookup('response__status__gt', 400, get)(entry2)
+    assert gets == ['response__status']
+
+
 def test_filter_items():
     entries = entries_fixtures
 
@@ -281,6 +332,813 @@ def test_Collection_QuerySet():
                        {'framework': 'Slim', 'somekey': None}])
 
 
+def test_JsonlSource_index():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = write_jsonl(tmpdir, entries_fixtures)
+        source = JsonlSource(path)
+        assert_list_equal(list(source), entries_fixtures)
+        assert source.indexes == {}
+
+        source.create_index('response__status', 'request__url')
+        # indexes are picked up when the source is opened again
+        source = JsonlSource(path)
+        assert_equal(sorted(source.indexes), ['request__url', 'response__status'])
+        c = Collection(source)
+        assert_list_equal(list(c.filter(response__status=200)), entries_fixtures[1:])
+        assert_list_equal(list(c.filter(response__status__gt=200)), entries_fixtures[:1])
+        assert_list_equal(list(c.filter(response__status__in=[404, 500])), entries_fixtures[:1])
+        assert_list_equal(list(c.filter(response__status=200,
+                                        request__url__endswith='.jpg')),
+                          entries_fixtures[2:])
+        assert_list_equal(list(c.filter(~Q(response__status=200))), entries_fixtures[:1])
+
+        # only candidates found using the index are read
+        read = list(source.candidates([Q(request__url='http://example.org')]))
+        assert_list_equal(read, entries_fixtures[1:2])
+
+        # truncated (eg. by an interrupted write) and empty index files
+        # are ignored
+        index_path = source.index_path('response__status')
+        with open(index_path, 'rb') as f:
+            data = f.read()
+        for size in (len(data) - 3, 30, 0):
+            with open(index_path, 'wb') as f:
+                f.write(data[:size])
+            source = JsonlSource(path)
+            assert_equal(sorted(source.indexes), ['request__url'])
+            assert_list_equal(list(Collection(source).filter(response__status=200)),
+                              entries_fixtures[1:])
+        # no temporary files are left behind
+        source.create_index('response__status')
+        assert_equal(sorted(os.listdir(tmpdir)),
+                     ['entries.jsonl', 'entries.jsonl.request__url.lkidx',
+                      'entries.jsonl.response__status.lkidx'])
+
+        assert_raises(LookupyError, JsonlSource, os.path.join(tmpdir, 'missing.jsonl'))
+
+        # stale indexes are ignored
+        write_jsonl(tmpdir, entries_fixtures[:2])
+        assert JsonlSource(path).indexes == {}
+
+        # including by a source that's kept open while the file changes
+        items = [{'a': i} for i in range(4)]
+        path = write_jsonl(tmpdir, items, name='items.jsonl')
+        source = JsonlSource(path)
+        source.create_index('a')
+        c = Collection(source)
+        assert_list_equal(list(c.filter(a=3)), items[3:])
+        with open(path, 'a') as f:
+            f.write(json.dumps({'a': 3}) + '\n')
+        assert_list_equal(list(c.filter(a=3)), [{'a': 3}, {'a': 3}])
+        assert source.indexes == {}
+        source.create_index('a')
+        write_jsonl(tmpdir, [{'a': 10 + i} for i in range(4)], name='items.jsonl')
+        assert_list_equal(list(c.filter(a=3)), [])
+        assert_list_equal(list(c.filter(a=13)), [{'a': 13}])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_Collection_save_load():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'entries.lkpy')
+        items = entries_fixtures + [{'n': 2 ** 70, 'x': 1.5, 'ok': True, 'no': False,
+                                     'none': None, 'u': u'\u00e9t\u00e9', 'l': [[], {}]}]
+        Collection(items).save(path, indexes=['response__status'])
+        c = Collection.load(path)
+        assert isinstance(c.data, SnapshotSource)
+        assert len(c.data) == 4
+        assert_list_equal(list(c), items)
+        assert c.data[3] == items[3]
+        assert_list_equal(list(c.filter(response__status=200)), entries_fixtures[1:])
+        assert_list_equal(list(c.data.candidates([Q(response__status__lt=300)])),
+                          entries_fixtures[1:])
+        assert_list_equal(list(c.filter(request__url__contains='jpg').select('request__url')),
+                          [{'request': {'url': 'http://example.com/myphoto.jpg'}}])
+        # strings are stored once
+        assert c.data[0]['request']['headers'][0]['name'] is c.data[1]['request']['headers'][0]['name']
+        c.data.close()
+
+        # the results of a QuerySet can be saved too
+        Collection(entries_fixtures).filter(response__status=404).save(path)
+        assert_list_equal(list(Collection.load(path)), entries_fixtures[:1])
+        assert_raises(LookupyError, Collection([{'s': set()}]).save, path)
+        # a failed save leaves the snapshot as it was
+        assert_list_equal(list(Collection.load(path)), entries_fixtures[:1])
+        assert_raises(LookupyError, Collection.load, write_jsonl(tmpdir, items[:3]))
+
+        # results of a query over a snapshot can be saved to the same file
+        Collection(items).save(path, indexes=['response__status'])
+        c = Collection.load(path)
+        c.filter(response__status__lt=300).save(path)
+        assert_list_equal(list(c), items)
+        assert_list_equal(list(Collection.load(path)), entries_fixtures[1:])
+        assert not [n for n in os.listdir(tmpdir) if n.endswith('.tmp')]
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_QuerySet_iter_batches():
+    c = Collection(entries_fixtures)
+    assert_list_equal(list(c.iter_batches(2)), [entries_fixtures[:2], entries_fixtures[2:]])
+    assert_list_equal(list(c.filter(response__status=404).iter_batches(2)),
+                      [entries_fixtures[:1]])
+
+
+def test_QuerySet_to_jsonl():
+    def jsonl(qs, **kwargs):
+        out = StringIO()
+        n = qs.to_jsonl(out, **kwargs)
+        lines = out.getvalue().splitlines()
+        assert n == len(lines)
+        return lines
+
+    c = Collection(entries_fixtures)
+    assert_list_equal(jsonl(c, batch_size=2), [json.dumps(e) for e in entries_fixtures])
+    qs = c.filter(response__status=200).select('request__url', 'response__status', 'request__method')
+    expected = [json.dumps(r) for r in Collection(entries_fixtures).filter(response__status=200)
+                .select('request__url', 'response__status', 'request__method')]
+    assert_list_equal(jsonl(qs), expected)
+    qs = c.select('request__url', 'response__status', flatten=True)
+    assert_list_equal(jsonl(qs), [json.dumps({'url': e['request']['url'],
+                                              'status': e['response']['status']})
+                                  for e in entries_fixtures])
+    # keys that can't be nested fall back to the selected dicts
+    qs = c.select('request', 'request__url')
+    assert len(jsonl(qs)) == 3
+    assert_list_equal(jsonl(Collection(list(compact_records(entries_fixtures)))),
+                      [json.dumps(e) for e in entries_fixtures])
+
+
+def test_QuerySet_to_csv():
+    c = Collection(entries_fixtures)
+    out = StringIO()
+    assert c.filter(response__status=200).select('request__url', 'response__status').to_csv(out) == 2
+    assert_equal(out.getvalue().splitlines(),
+                 ['request__url,response__status',
+                  'http://example.org,200',
+                  'http://example.com/myphoto.jpg,200'])
+    out = StringIO()
+    c.filter(response__status=404).to_csv(out, fields=['response__status', 'cookies', 'request__headers'],
+                                          header=False)
+    assert_equal(out.getvalue().splitlines(),
+                 ['404,,"[{""name"": ""Connection"", ""value"": ""Keep-Alive""}]"'])
+    assert_raises(LookupyError, c.to_csv, StringIO())
+    flat = c.filter(response__status=200).select('request__url', 'response__status', flatten=True)
+    out = StringIO()
+    assert flat.to_csv(out) == 2
+    assert_equal(out.getvalue().splitlines(),
+                 ['url,status',
+                  'http://example.org,200',
+                  'http://example.com/myphoto.jpg,200'])
+    for fields in (['status'], ['response__status']):
+        out = StringIO()
+        flat.to_csv(out, fields=fields)
+        assert_equal(out.getvalue().splitlines(), fields + ['200', '200'])
+
+
+def test_BloomFilter():
+    bf = BloomFilter(100)
+    words = ['word{i}'.format(i=i) for i in range(100)]
+    for w in words:
+        bf.add(w)
+    assert all(w in bf for w in words)
+    misses = sum(1 for i in range(1000) if 'other{i}'.format(i=i) in bf)
+    assert misses < 50
+    assert all(w in BloomFilter.from_dict(bf.to_dict()) for w in words)
+
+
+def test_HyperLogLog():
+    hll, other = HyperLogLog(), HyperLogLog()
+    for i in range(20000):
+        hll.add('http://example.com/{i}'.format(i=i % 10000))
+        other.add(i)
+    assert abs(hll.count() - 10000) < 300
+    assert abs(other.count() - 20000) < 600
+    hll.merge(other)
+    assert abs(hll.count() - 30000) < 900
+    small = HyperLogLog()
+    for v in [1, 1.0, True, 'a', 'a', None]:
+        small.add(v)
+    assert small.count() == 3
+
+
+def test_QuantileSketch():
+    a, b = QuantileSketch(k=100, seed=1), QuantileSketch(k=100, seed=2)
+    for i in range(10000):
+        a.add(i)
+        b.add(10000 + i)
+    assert sum(len(l) for l in a.levels) < 400
+    p50, p99 = a.quantiles([0.5, 0.99])
+    assert abs(p50 - 5000) < 300
+    assert abs(p99 - 9900) < 300
+    a.merge(b)
+    assert a.count == 20000
+    assert abs(a.quantiles([0.5])[0] - 10000) < 600
+    assert QuantileSketch().quantiles([0.5]) == [None]
+
+
+def test_ReservoirSample():
+    a, b = ReservoirSample(100, seed=1), ReservoirSample(100, seed=2)
+    for i in range(1000):
+        a.add(i)
+        b.add(-i - 1)
+    assert len(a.values) == 100
+    assert len(set(a.values)) == 100
+    a.merge(b)
+    assert len(a.values) == 100
+    assert a.count == 2000
+    assert 20 < sum(1 for v in a.values if v < 0) < 80
+
+
+def test_FieldSummary():
+    fs = FieldSummary.of([404, 200, None, 302])
+    assert fs.may_match('exact', 200)
+    assert not fs.may_match('exact', 500)
+    assert fs.may_match('exact', None)
+    assert not fs.may_match('exact', 'GET')
+    assert fs.may_match('in', [500, 302])
+    assert not fs.may_match('in', [500, 503])
+    assert fs.may_match('gt', 400)
+    assert not fs.may_match('gte', 405)
+    assert not fs.may_match('lt', 200)
+    assert fs.may_match('lte', 200)
+    assert fs.may_match('contains', 'x')
+
+    fs = FieldSummary.of(['GET', 'POST'])
+    assert fs.may_match('exact', 'GET')
+    assert not fs.may_match('exact', 'PUT')
+    # comparing strings with numbers raises an error while scanning
+    assert fs.may_match('gt', 5)
+
+    fs = FieldSummary.of([[1], 'x'])
+    assert fs.may_match('exact', 'y')
+
+
+def test_compressed_sources():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        data = ''.join(json.dumps(e) + '\n' for e in entries_fixtures).encode('utf-8')
+        har = json.dumps({'log': {'entries': entries_fixtures}}).encode('utf-8')
+        for name, opener in [('gzip', gzip.open), ('bz2', bz2.open), ('xz', lzma.open)]:
+            path = os.path.join(tmpdir, 'entries.jsonl.' + name)
+            with opener(path, 'wb') as f:
+                f.write(data)
+            assert detect_compression(path) == name
+            for readahead in [0, 2]:
+                c = Collection(JsonlSource(path, readahead=readahead))
+                assert_list_equal(list(c.filter(response__status=200)), entries_fixtures[1:])
+            assert_raises(LookupyError, JsonlSource(path).create_index, 'response__status')
+            # indexes of compressed files aren't even opened
+            class Unindexed(JsonlSource):
+                def load_indexes(self):
+                    raise AssertionError('Indexes loaded')
+            assert Unindexed(path).indexes == {}
+
+            path = os.path.join(tmpdir, 'www.example.com.har.' + name)
+            with opener(path, 'wb') as f:
+                f.write(har)
+            assert_list_equal(list(JsonSource(path, readahead=1)), entries_fixtures)
+        path = os.path.join(tmpdir, 'entries.json')
+        with open(path, 'w') as f:
+            json.dump({'data': {'items': entries_fixtures}}, f)
+        assert detect_compression(path) is None
+        assert_list_equal(list(JsonSource(path, key='data__items')), entries_fixtures)
+        assert_raises(LookupyError, list, JsonSource(path))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_read_ahead():
+    assert_list_equal(list(read_ahead(iter(range(1000)), size=2, batch_size=7)), list(range(1000)))
+    def failing():
+        yield 1
+        raise ValueError('oops')
+    assert_raises(ValueError, list, read_ahead(failing()))
+    # stopping early doesn't block the background thread
+    items = read_ahead(iter(range(100000)), size=1, batch_size=10)
+    assert next(items) == 0
+    items.close()
+
+
+def test_ChunkedSource():
+    items = [{'n': i, 'name': 'item{i}'.format(i=i)} for i in range(100)]
+    source = ChunkedSource.from_items(items, chunk_size=10, fields=['n', 'name'])
+    assert len(source.chunks) == 10
+    assert_list_equal(list(source), items)
+    c = Collection(source)
+    assert_list_equal(list(c.filter(n__gte=95)), items[95:])
+    assert_list_equal(list(c.filter(name='item42')), items[42:43])
+    assert len(list(source.candidates([Q(n__gte=95)]))) == 10
+    assert len(list(source.candidates([Q(n__gte=95) | Q(n=1)]))) == 100
+    assert len(list(source.candidates([Q(n=1000)]))) == 0
+
+
+def test_datetime_lookups():
+    entries = [{'startedDateTime': '2013-07-12T23:30:00.000Z'},
+               {'startedDateTime': '2013-07-13T01:30:00+02:00'},
+               {'startedDateTime': '2013-07-13T10:00:00'},
+               {'startedDateTime': '2014-01-01T00:00:00Z'},
+               {'startedDateTime': 'yesterday'},
+               {'startedDateTime': None},
+               {}]
+    assert_list_equal(fe(entries, startedDateTime__gte=datetime(2013, 7, 13)),
+                      entries[2:4])
+    # naive datetimes are in UTC just like the timestamps
+    assert_list_equal(fe(entries, startedDateTime__lt=datetime(2013, 7, 13, tzinfo=timezone.utc)),
+                      entries[:2])
+    assert_list_equal(fe(entries, startedDateTime__gt=date(2013, 7, 13)), entries[2:4])
+    assert_list_equal(fe(entries, startedDateTime__range=(datetime(2013, 7, 12, 23, 30),
+                                                          datetime(2013, 7, 13, 10))),
+                      entries[:3])
+    assert_list_equal(fe(entries, startedDateTime__date=date(2013, 7, 12)), entries[:2])
+    assert_list_equal(fe(entries, startedDateTime__date='2013-07-13'), entries[2:3])
+    assert_list_equal(fe(entries, startedDateTime__year=2014), entries[3:4])
+    assert_list_equal(fe(entries, ~Q(startedDateTime__year=2013)), entries[3:])
+    # ranges of other values are compared as they are
+    assert_list_equal(fe([{'n': 1}, {'n': 5}, {'n': None}], n__range=[2, 5]), [{'n': 5}])
+    assert_raises(LookupyError, fe, entries, startedDateTime__date='July')
+    assert_raises(LookupyError, fe, entries, startedDateTime__year='2013')
+    assert_raises(LookupyError, fe, entries, startedDateTime__range=date(2013, 7, 12))
+
+
+def test_ChunkedSource_time_field():
+    start = datetime(2013, 7, 12)
+    items = [{'n': i, 'time': (start + timedelta(minutes=i)).isoformat() + 'Z'}
+             for i in range(100)]
+    # the last chunk isn't in time order
+    items[95], items[99] = items[99], items[95]
+    source = ChunkedSource.from_items(items, chunk_size=10, time_field='time')
+    c = Collection(source)
+    window = Q(time__gte=start + timedelta(minutes=42), time__lt=start + timedelta(minutes=45))
+    assert_list_equal(list(c.filter(window)), items[42:45])
+    assert len(list(source.candidates([window]))) == 4
+    late = Q(time__range=(start + timedelta(minutes=95), start + timedelta(minutes=97)))
+    assert_list_equal(list(c.filter(late)), [items[96], items[97], items[99]])
+    assert_list_equal([i['n'] for i in source.candidates([late])], [96, 97, 95])
+    assert len(list(source.candidates([Q(time__year=2012)]))) == 0
+    assert len(list(source.candidates([Q(time__date='2013-07-12')]))) == 100
+    assert len(list(source.candidates([Q(time__gte=start) | Q(n=1)]))) == 100
+
+
+def test_JsonlSource_zone_maps():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        items = [{'n': i, 'name': 'item{i}'.format(i=i)} for i in range(100)]
+        path = write_jsonl(tmpdir, items)
+        JsonlSource(path).create_zone_maps(['n', 'name'], chunk_size=30)
+        source = JsonlSource(path)
+        assert len(source.zone_maps) == 4
+        c = Collection(source)
+        assert_list_equal(list(c.filter(n__lt=5)), items[:5])
+        assert_list_equal(list(c.filter(name__in=['item31', 'item99'])),
+                          [items[31], items[99]])
+        assert len(list(source.candidates([Q(n__lt=5)]))) == 30
+        assert len(list(source.candidates([Q(n__gte=90)]))) == 10
+        assert_equal(sorted(os.listdir(tmpdir)), ['entries.jsonl', 'entries.jsonl.lkzm'])
+
+        # lines appended while the source is open aren't skipped
+        with open(path, 'a') as f:
+            f.write(json.dumps({'n': 3}) + '\n')
+        assert_list_equal(list(c.filter(n=3)), [items[3], {'n': 3}])
+        assert source.zone_maps == []
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_compact_records():
+    records = list(compact_records(entries_fixtures))
+    assert all(isinstance(r, CompactRecord) for r in records)
+    assert_list_equal(records, entries_fixtures)
+    assert_equal([r.to_dict() for r in records], entries_fixtures)
+    assert type(records[0].to_dict()['request']) is dict
+    # shapes and strings are shared across records
+    assert records[0]._shape is records[1]._shape
+    assert records[0]['request']['headers'][0]['value'] is records[1]['request']['headers'][0]['value']
+    assert dunder_get(records[2], 'response__status') == 200
+    assert dunder_get(records[2], 'response__unknown') is None
+
+    c = Collection(records)
+    assert_list_equal(list(c.filter(response__headers__filter=Q(value__startswith='image/'))),
+                      entries_fixtures[2:])
+    assert_list_equal(list(c.filter(response__status=404).select('request__url')),
+                      [{'request': {'url': 'http://example.com'}}])
+
+    r = records[0]['response']
+    assert sys.getsizeof(r) + sys.getsizeof(r._values) < sys.getsizeof(entries_fixtures[0]['response'])
+
+    interned = list(compact_records(entries_fixtures, compact=False))
+    assert type(interned[0]) is dict
+    assert_list_equal(interned, entries_fixtures)
+
+
+def test_JsonlSource_compact():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = write_jsonl(tmpdir, entries_fixtures)
+        items = list(JsonlSource(path, compact=True))
+        assert isinstance(items[0], CompactRecord)
+        assert_list_equal(items, entries_fixtures)
+        c = Collection(JsonlSource(path, intern=True))
+        assert_list_equal(list(c.filter(response__status=200)), entries_fixtures[1:])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_QuerySet_steps():
+    c = Collection(entries_fixtures)
+    qs = c.filter(response__status=200).select('request__url')
+    assert qs.source is entries_fixtures
+    assert len(qs.steps) == 2
+    assert_list_equal(list(qs), [{'request': {'url': 'http://example.org'}},
+                                 {'request': {'url': 'http://example.com/myphoto.jpg'}}])
+
+
+class CountingIterable(object):
+
+    def __init__(self, items):
+        self.items = items
+        self.reads = 0
+
+    def __iter__(self):
+        for item in self.items:
+            self.reads += 1
+            yield item
+
+
+def test_QuerySet_values():
+    c = Collection(entries_fixtures)
+    assert_list_equal(list(c.values('response__status')), [404, 200, 200])
+    assert_list_equal(list(c.filter(response__status=200).values('request__url', 'response__status')),
+                      [('http://example.org', 200), ('http://example.com/myphoto.jpg', 200)])
+    assert_raises(LookupyError, c.values)
+
+    # semi-join and anti-join
+    source = CountingIterable(entries_fixtures)
+    c = Collection(source)
+    urls = Collection([{'url': 'http://example.org'}, {'url': 'http://example.com'},
+                       {'url': 'http://example.org'}]).values('url')
+    qs = c.filter(request__url__in=urls)
+    # nothing is evaluated until the items are consumed
+    assert urls._members is None
+    assert_list_equal(list(qs), entries_fixtures[:2])
+    assert_list_equal(list(c.filter(~Q(request__url__in=urls))), entries_fixtures[2:])
+    assert_equal(urls._members, frozenset(['http://example.com', 'http://example.org']))
+    assert source.reads == 6
+    # the subquery may be derived from the same source
+    errors = c.filter(response__status__gte=400).values('request__url')
+    assert_list_equal(list(c.filter(request__url__in=errors)), entries_fixtures[:1])
+    # unhashable results are compared one by one
+    headers = c.values('request__headers')
+    assert len(list(c.filter(request__headers__in=headers))) == 3
+    assert isinstance(headers._members, tuple)
+    assert not urls.contains_value(['http://example.com'])
+
+
+def test_QuerySet_order_by():
+    items = [{'n': 2, 'name': 'b'}, {'n': None, 'name': 'c'}, {'n': 1, 'name': 'a'},
+             {'n': 2, 'name': 'a'}, {'name': 'd'}]
+    c = Collection(items)
+    assert_list_equal([i['name'] for i in c.order_by('n')], ['c', 'd', 'a', 'b', 'a'])
+    assert_list_equal([i['name'] for i in c.order_by('-n', 'name')], ['a', 'b', 'a', 'c', 'd'])
+    assert_list_equal(list(c.filter(n__gte=2).order_by('-name').select('name')),
+                      [{'name': 'b'}, {'name': 'a'}])
+    assert_raises(LookupyError, c.order_by)
+    assert_raises(LookupyError, list, Collection([{'n': [1]}]).order_by('n'))
+
+    # steps after an ordering are applied to all the items at once
+    expected = list(c.filter(n__gte=1).order_by('-n', 'name').select('name'))
+    qs = c.filter(n__gte=1).order_by('-n', 'name').select('name')
+    assert_list_equal(list(qs.threaded(workers=2, batch_size=2, force=True)), expected)
+    assert_equal(c.run_many({'ordered': qs, 'all': c.filter()}),
+                 {'ordered': expected, 'all': items})
+    live = LiveCollection(items)
+    assert_raises(LookupyError, live.register, live.order_by('n'))
+
+
+def paginate_all(qs, page_size):
+    results, cursor = [], None
+    while True:
+        page = qs.paginate(page_size, after=cursor)
+        assert len(page) <= page_size
+        results.extend(page)
+        if not page.has_next:
+            return results
+        cursor = page.next_cursor
+
+
+def test_QuerySet_paginate():
+    items = [{'n': i % 7, 'name': 'item{i}'.format(i=i)} for i in range(50)]
+    c = Collection(items)
+    qs = c.filter(n__gte=1).order_by('-n', 'name')
+    expected = list(qs)
+    for size in (1, 7, 42, 100):
+        assert_list_equal(paginate_all(qs, size), expected)
+    qs = c.order_by('n').values('name')
+    assert_list_equal(paginate_all(qs, 5), list(qs))
+    page = qs.paginate(3)
+    assert_list_equal(page.items, ['item0', 'item7', 'item14'])
+    assert_list_equal(qs.paginate(3, after=page.next_cursor).items,
+                      ['item21', 'item28', 'item35'])
+    assert not c.order_by('n').paginate(50).has_next
+    assert_raises(LookupyError, c.filter(n=1).paginate, 5)
+    assert_raises(LookupyError, qs.paginate, 5, 'not a cursor')
+    assert_raises(LookupyError, c.order_by('-n').paginate, 5, page.next_cursor)
+    assert_raises(LookupyError, Collection(iter(items)).order_by('n').paginate, 5)
+
+    # pages are found by seeking in the index of the order field
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = write_jsonl(tmpdir, items)
+        JsonlSource(path).create_index('n')
+        source = JsonlSource(path)
+        c = Collection(source)
+        expected = dict((o, list(c.filter(name__contains='1').order_by(o)))
+                        for o in ('n', '-n'))
+        def scan():
+            raise AssertionError('Source scanned')
+        source.positioned = scan
+        for o in ('n', '-n'):
+            qs = Collection(source).filter(name__contains='1').order_by(o)
+            assert_list_equal(paginate_all(qs, 4), expected[o])
+    finally:
+        shutil.rmtree(tmpdir)
+
+    # or by binary search in a source that's in order of the field
+    start = datetime(2013, 7, 12)
+    items = [{'n': i, 'time': None if i < 4 else (start + timedelta(minutes=i // 3)).isoformat()}
+             for i in range(60)]
+    source = ChunkedSource.from_items(items, chunk_size=7, time_field='time')
+    assert source.ordered_by == 'time'
+    c = Collection(source)
+    expected = dict((o, list(c.filter(n__gte=2, n__lt=50).order_by(o)))
+                    for o in ('time', '-time'))
+    source.positioned = scan
+    for o in ('time', '-time'):
+        qs = Collection(source).filter(n__gte=2, n__lt=50).order_by(o)
+        for size in (1, 4, 100):
+            assert_list_equal(paginate_all(qs, size), expected[o])
+    items[10], items[20] = items[20], items[10]
+    assert ChunkedSource.from_items(items, chunk_size=7, time_field='time').ordered_by is None
+
+
+def test_expressions():
+    entries = [{'timings': {'send': 1, 'wait': 10, 'receive': 4}},
+               {'timings': {'send': 5, 'wait': 8, 'receive': 4}},
+               {'timings': {'send': None, 'wait': 8, 'receive': 4}},
+               {'timings': {'wait': 9, 'receive': 9}}]
+    total = F('timings__send') + F('timings__receive')
+    assert_list_equal([total.compile()(e) for e in entries], [5, 9, None, None])
+    assert_list_equal([(2 * -F('timings__wait') / 4).compile()(e) for e in entries],
+                      [-5.0, -4.0, -4.0, -4.5])
+    assert_list_equal(fe(entries, timings__wait__gt=total), entries[:1])
+    assert_list_equal(fe(entries, timings__wait__lte=total), entries[1:2])
+    assert_list_equal(fe(entries, ~Q(timings__wait__lte=total)), [entries[0]] + entries[2:])
+    assert_list_equal(fe(entries, timings__receive=F('timings__wait') - 4), entries[1:3])
+    assert_list_equal(fe(entries, timings__wait__neq=F('timings__receive')), entries[:3])
+    assert_list_equal(fe(entries, timings__send__gt=F('timings__nonexistent')), [])
+    assert_raises(LookupyError, fe, entries, timings__wait__contains=F('timings__send'))
+    # expressions aren't specialized but give the same results
+    c = Collection(entries)
+    assert_list_equal(list(c.filter(timings__wait__gt=total).specialize()), entries[:1])
+
+
+def test_QuerySet_annotate():
+    entries = [{'url': 'a', 'timings': {'send': 1, 'wait': 10}},
+               {'url': 'b', 'timings': {'send': 5, 'wait': None}}]
+    c = Collection(entries)
+    qs = c.annotate(total=F('timings__send') + F('timings__wait'), double=F('timings__send') * 2)
+    assert_list_equal(list(qs.select('url', 'total', 'double')),
+                      [{'url': 'a', 'total': 11, 'double': 2},
+                       {'url': 'b', 'total': None, 'double': 10}])
+    # items are copied
+    assert 'total' not in entries[0]
+    assert_list_equal(list(c.annotate(total=F('timings__send') + F('timings__wait'))
+                            .filter(total__gt=10).values('url')), ['a'])
+    assert_equal(c.annotate(double=F('timings__send') * 2).aggregate(s=Sum('double')), {'s': 12})
+    assert_raises(LookupyError, c.annotate, a__b=F('url'))
+    assert_raises(LookupyError, c.annotate, a=1)
+    # annotations are applied one item at a time too
+    live = LiveCollection([{'n': 1}])
+    sq = live.register(live.annotate(double=F('n') * 2).filter(double__gt=5))
+    live.extend([{'n': 2}, {'n': 3}])
+    assert_list_equal(sq.results, [{'n': 3, 'double': 6}])
+    # and the expressions are compiled only once for them
+    compiled = []
+    class CountingF(F):
+        def compile(self, get=dunder_get):
+            compiled.append(self.field)
+            return super(CountingF, self).compile(get)
+    qs = c.annotate(double=CountingF('timings__send') * 2)
+    assert_list_equal(list(qs.threaded(workers=2, batch_size=1, force=True).values('double')),
+                      [2, 10])
+    assert_equal(compiled, ['timings__send'])
+
+
+def test_QuerySet_run_many():
+    source = CountingIterable(entries_fixtures)
+    c = Collection(source)
+    queries = {'ok': c.filter(response__status=200).select('request__url'),
+               'com': c.filter(request__url__contains='.com'),
+               'either': c.filter(Q(response__status=404) | Q(request__url__endswith='.jpg'),
+                                  response__status__in=[200, 404]),
+               'all': c}
+    results = c.run_many(queries)
+    assert source.reads == len(entries_fixtures)
+    assert_equal(results, {'ok': [{'request': {'url': 'http://example.org'}},
+                                  {'request': {'url': 'http://example.com/myphoto.jpg'}}],
+                           'com': [entries_fixtures[0], entries_fixtures[2]],
+                           'either': [entries_fixtures[0], entries_fixtures[2]],
+                           'all': entries_fixtures})
+    assert_raises(LookupyError, c.run_many, {'x': Collection(entries_fixtures).filter()})
+
+    shared = SharedGetter()
+    shared.reset(entries_fixtures[0])
+    assert shared.get(entries_fixtures[0], 'response__status') == 404
+    assert shared.values == {'response__status': 404}
+    assert shared.get(entries_fixtures[1], 'response__status') == 200
+    assert shared.values == {'response__status': 404}
+
+
+def test_QuerySet_threaded():
+    items = [{'n': i, 'tags': ['x'] * (i % 3)} for i in range(1000)]
+    c = Collection(items)
+    qs = c.filter(Q(n__gte=100) | Q(tags__filter=Q())).select('n')
+    expected = list(Collection(items).filter(Q(n__gte=100) | Q(tags__filter=Q())).select('n'))
+    assert_list_equal(list(qs.threaded(workers=4, batch_size=7, force=True)), expected)
+    assert_list_equal(list(qs.threaded(workers=4, batch_size=7)), expected)
+    # batches from a source that can rule out items up front
+    source = ChunkedSource.from_items(items, chunk_size=100, fields=['n'])
+    assert_list_equal(list(Collection(source).filter(n__lt=10).threaded(batch_size=3, force=True)),
+                      items[:10])
+
+
+def test_infer_schema():
+    schema = infer_schema(entries_fixtures, ['response__status', 'request__url',
+                                              'request__headers', 'cookies', 'request__url__x'])
+    assert_equal(schema, {'response__status': int, 'request__url': str})
+    assert_equal(infer_schema(entries_fixtures + [{'response': {'status': '200'}}],
+                              ['response__status']), {})
+    assert_equal(infer_schema(list(compact_records(entries_fixtures)), ['response__status']),
+                 {'response__status': int})
+
+
+def test_specialize():
+    items = entries_fixtures + [{'request': {'url': 'http://example.net'}, 'response': None},
+                                {'request': {'url': 'HTTP://EXAMPLE.COM/X.JPG'},
+                                 'response': {'status': 404.0, 'headers': []}},
+                                {'request': {}, 'response': {'status': None}}]
+    queries = [(Q(response__status__gte=300) | Q(request__url__iendswith='.jpg'),),
+               (~Q(request__url__icontains='example.org', response__status__in=[200, 404]),),
+               (Q(response__headers__filter=Q(value__startswith='image/')), Q(response__status=200)),
+               (Q(request__url__regex=r'\.com'), ~Q(response__status__neq=404)),
+               (Q(),)]
+    def outcome(predicate, item):
+        try:
+            return bool(predicate(item))
+        except Exception as e:
+            return type(e)
+
+    schema = infer_schema(entries_fixtures, ['response__status', 'request__url'])
+    for q in queries:
+        predicate = FilterStep(*q).compile()
+        specialized = specialize(list(q), schema, predicate)
+        assert_equal([outcome(specialized, e) for e in items],
+                     [outcome(predicate, e) for e in items])
+
+    calls = []
+    def fallback(item):
+        calls.append(item)
+        return False
+    specialized = specialize([Q(response__status__gt=300, request__url__startswith='http')],
+                             {'response__status': int, 'request__url': str}, fallback)
+    assert "item['response']['status']" in specialized.source
+    assert_list_equal([specialized(e) for e in items[:5]], [True, False, False, False, False])
+    assert_list_equal(calls, items[3:5])
+    assert_raises(LookupyError, specialize, [Q(request__url__contains=1)], {}, fallback)
+
+
+def test_QuerySet_specialize():
+    c = Collection(entries_fixtures)
+    qs = c.filter(Q(response__status=404) | Q(request__url__endswith='.jpg')).select('request__url')
+    assert_list_equal(list(qs.specialize()), list(Collection(entries_fixtures)
+                                                  .filter(Q(response__status=404) |
+                                                          Q(request__url__endswith='.jpg'))
+                                                  .select('request__url')))
+    assert "item['request']['url']" in qs.specialize().steps[0]._predicate.source
+    assert_raises(LookupyError, Collection(iter(entries_fixtures)).filter().specialize)
+
+
+def test_aggregate():
+    c = Collection(entries_fixtures)
+    assert_equal(c.aggregate(n=Count(), total=Sum('response__status'),
+                             lo=Min('response__status'), hi=Max('response__status'),
+                             avg=Avg('response__status'), missing=Count('cookies')),
+                 {'n': 3, 'total': 804, 'lo': 200, 'hi': 404, 'avg': 268.0, 'missing': 0})
+    assert_equal(c.filter(response__status=500).aggregate(avg=Avg('response__status'),
+                                                          hi=Max('response__status')),
+                 {'avg': None, 'hi': None})
+    a, b = Sum('n'), Sum('n')
+    a.add({'n': 1})
+    b.add({'n': 2})
+    a.merge(b)
+    assert a.value == 3
+
+
+def test_approximate_aggregates():
+    items = [{'url': 'u{i}'.format(i=i % 500), 'wait': i} for i in range(5000)]
+    c = Collection(items)
+    assert abs(c.approx_count_distinct('url') - 500) < 25
+    p50, p99 = Collection(items).approx_quantiles('wait', [0.5, 0.99])
+    assert abs(p50 - 2500) < 250
+    assert abs(p99 - 4950) < 250
+    sample = Collection(items).filter(wait__lt=1000).sample(10, seed=3)
+    assert len(sample) == 10
+    assert all(s['wait'] < 1000 for s in sample)
+    assert_list_equal(sample, Collection(items).filter(wait__lt=1000).sample(10, seed=3))
+
+    # aggregates over partitions can be merged
+    d1, d2 = ApproxCountDistinct('url'), ApproxCountDistinct('url')
+    for item in items[:2000]:
+        d1.add(item)
+    for item in items[2000:]:
+        d2.add(item)
+    d1.merge(d2)
+    assert d1.value == c.approx_count_distinct('url')
+    assert c.aggregate(s=Sample(3), q=ApproxQuantiles('missing', [0.5]))['q'] == [None]
+
+
+def test_LiveCollection():
+    live = LiveCollection(entries_fixtures[:1])
+    matched = []
+    sq = live.register(live.filter(response__status=200).select('request__url'),
+                       aggregates={'n': Count()},
+                       callback=matched.append)
+    other = live.register(live.filter(response__status=404))
+    assert sq.values == {'n': 0}
+    assert len(other.results) == 1
+    live.extend(entries_fixtures[1:])
+    assert_list_equal(matched, [{'request': {'url': 'http://example.org'}},
+                                {'request': {'url': 'http://example.com/myphoto.jpg'}}])
+    assert_list_equal(sq.results, matched)
+    assert sq.values == {'n': 2}
+    assert len(other.results) == 1
+    assert len(list(live.filter(response__status=200))) == 2
+    assert_raises(LookupyError, live.register, Collection(entries_fixtures).filter())
+
+
+def test_parse_filter():
+    entries = entries_fixtures
+    q = parse_filter('response__status=200 & ~request__url__endswith=.jpg')
+    assert_list_equal(fe(entries, q), entries[1:2])
+    q = parse_filter('response__status__in=[404, 500] | (request__url__contains=".org" & response__status=200)')
+    assert_list_equal(fe(entries, q), entries[:2])
+    q = parse_filter('~(response__status=200 | request__url="http://example.com")')
+    assert_list_equal(fe(entries, q), [])
+    assert_list_equal(fe(entries, parse_filter('response__unknown=null')), entries)
+    for expr in ('', 'response__status', '(response__status=200', 'a=1 b=2', 'a=1 |', '~'):
+        assert_raises(LookupyError, parse_filter, expr)
+    # values of lookups on strings are taken as strings
+    items = [{'url': 'http://example.com/404'}, {'url': 'http://example.com/200'}]
+    assert_list_equal(fe(items, parse_filter('url__contains=404')), items[:1])
+    assert_list_equal(fe(items, parse_filter('url__endswith="200"')), items[1:])
+
+
+def test_cli():
+    tmpdir = tempfile.mkdtemp()
+    stdout, stderr = sys.stdout, sys.stderr
+    try:
+        har = os.path.join(tmpdir, 'a.har.gz')
+        with gzip.open(har, 'wt') as f:
+            json.dump({'log': {'entries': entries_fixtures}}, f)
+        jsonl = write_jsonl(tmpdir, entries_fixtures, name='b.jsonl')
+        for jobs in ('1', '2'):
+            sys.stdout, sys.stderr = StringIO(), StringIO()
+            status = cli_main(['-f', 'response__status=200', '-s', 'request__url',
+                               '-j', jobs, '--stats', har, jsonl])
+            assert status == 0
+            assert_list_equal([json.loads(l) for l in sys.stdout.getvalue().splitlines()],
+                              [{'request': {'url': 'http://example.org'}},
+                               {'request': {'url': 'http://example.com/myphoto.jpg'}}] * 2)
+            assert sys.stderr.getvalue().startswith('files: 2, records: 6, matches: 4,')
+        # directories are expanded to the json files in them
+        sys.stdout = StringIO()
+        assert cli_main(['-f', 'response__status=404', '-s', 'response__status', tmpdir]) == 0
+        assert sys.stdout.getvalue() == '{"response": {"status": 404}}\n' * 2
+        sys.stderr = StringIO()
+        assert cli_main([os.path.join(tmpdir, 'missing.json')]) == 1
+        # values that can't be compared are reported without a traceback
+        sys.stderr = StringIO()
+        assert cli_main(['-f', 'response__status__gt=abc', jsonl]) == 1
+        assert sys.stderr.getvalue().startswith('lookupy: error: ')
+        assert_raises(SystemExit, cli_main, ['-f', 'response__status=(', har])
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        shutil.rmtree(tmpdir)
+
+
 ## nesdict tests
 
 def test_dunderkey():
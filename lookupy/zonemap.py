@@ -0,0 +1,173 @@
+"""
+   lookupy.zonemap
+   ~~~~~~~~~~~~~~~
+
+   This module deals with zone maps ie. summaries of the values of a
+   field in a chunk of items. A summary keeps the min and max of the
+   numbers and strings and a Bloom filter of the strings, which is
+   enough to prove that no item in the chunk can match lookups such as
+   *exact*, *in*, *gt* or *lt*, so that the chunk can be skipped
+   without reading it.
+
+"""
+
+import math
+
+from .lookupy import conjunctive_lookups
+from .dunderkey import dunder_get
+from .sketches import BloomFilter
+
+
+class FieldSummary(object):
+    """Summary of the values of a field in a chunk of items"""
+
+    def __init__(self):
+        self.count = 0
+        self.has_none = False
+        # values that are neither numbers nor strings, eg. lists
+        self.has_other = False
+        self.num_min = self.num_max = None
+        self.str_min = self.str_max = None
+        self.bloom = None
+
+    @classmethod
+    def of(cls, values, fp_rate=0.01):
+        """Builds a summary from the values of the field
+
+        :param values  : iterable of values
+        :param fp_rate : (float) false positive rate of the Bloom filter
+        :rtype         : FieldSummary
+
+        """
+        fs = cls()
+        strings = set()
+        for v in values:
+            fs.count += 1
+            if v is None:
+                fs.has_none = True
+            elif isinstance(v, (bool, int, float)):
+                if isinstance(v, float) and math.isnan(v):
+                    fs.has_other = True
+                elif fs.num_min is None:
+                    fs.num_min = fs.num_max = v
+                else:
+                    fs.num_min = min(fs.num_min, v)
+                    fs.num_max = max(fs.num_max, v)
+            elif isinstance(v, str):
+                strings.add(v)
+            else:
+                fs.has_other = True
+        if strings:
+            fs.str_min, fs.str_max = min(strings), max(strings)
+            fs.bloom = BloomFilter(len(strings), fp_rate)
+            for s in strings:
+                fs.bloom.add(s)
+        return fs
+
+    @property
+    def has_numbers(self):
+        return self.num_min is not None
+
+    @property
+    def has_strings(self):
+        return self.str_min is not None
+
+    def may_match(self, op, val):
+        """Checks whether any item in the chunk may satisfy a lookup
+
+        Returns False only if it's certain that none of them do. If
+        evaluating the lookup could raise an error for some item
+        (eg. when comparing strings with numbers), the chunk is not
+        ruled out so that the error surfaces just like it would
+        without the summary.
+
+        :param op  : (str) lookup type
+        :param val : (mixed) value to lookup
+        :rtype     : (boolean)
+
+        """
+        if self.has_other:
+            return True
+        if op == 'exact':
+            if val is None:
+                return self.has_none
+            if isinstance(val, (bool, int, float)):
+                return self.has_numbers and self.num_min <= val <= self.num_max
+            if isinstance(val, str):
+                return (self.has_strings and self.str_min <= val <= self.str_max
+                        and val in self.bloom)
+            return True
+        if op == 'in':
+            # other iterables may not be consumed more than once and
+            # strings test for containment
+            if not isinstance(val, (list, tuple, set, frozenset)):
+                return True
+            return any(self.may_match('exact', v) for v in val)
+        if op in ('gt', 'gte', 'lt', 'lte'):
+            if isinstance(val, (bool, int, float)):
+                if self.has_strings:
+                    return True
+                lo, hi = self.num_min, self.num_max
+            elif isinstance(val, str):
+                if self.has_numbers:
+                    return True
+                lo, hi = self.str_min, self.str_max
+            else:
+                return True
+            if lo is None:
+                return False
+            if op == 'gt':
+                return hi > val
+            if op == 'gte':
+                return hi >= val
+            if op == 'lt':
+                return lo < val
+            return lo <= val
+        return True
+
+    def to_dict(self):
+        return {'count': self.count,
+                'has_none': self.has_none,
+                'has_other': self.has_other,
+                'num': [self.num_min, self.num_max],
+                'str': [self.str_min, self.str_max],
+                'bloom': None if self.bloom is None else self.bloom.to_dict()}
+
+    @classmethod
+    def from_dict(cls, d):
+        fs = cls()
+        fs.count = d['count']
+        fs.has_none = d['has_none']
+        fs.has_other = d['has_other']
+        fs.num_min, fs.num_max = d['num']
+        fs.str_min, fs.str_max = d['str']
+        fs.bloom = None if d['bloom'] is None else BloomFilter.from_dict(d['bloom'])
+        return fs
+
+
+def summarize(items, fields, fp_rate=0.01):
+    """Builds the zone map of a chunk of items
+
+    :param items   : (list) of dicts
+    :param fields  : dunder keys of the fields to summarize
+    :param fp_rate : (float) false positive rate of the Bloom filters
+    :rtype         : (dict) mapping fields to ``FieldSummary`` objects
+
+    """
+    return dict((f, FieldSummary.of((dunder_get(item, f) for item in items), fp_rate))
+                for f in fields)
+
+
+def may_match(zone_map, lookup_groups):
+    """Checks whether any item in a chunk may match the lookup groups
+
+    :param zone_map      : (dict) as returned by ``summarize``
+    :param lookup_groups : (list) of ``Q`` objects
+    :rtype               : (boolean) False only if no item can match
+
+    """
+    for field, op, val in conjunctive_lookups(lookup_groups):
+        summary = zone_map.get(field)
+        if summary is not None and not summary.may_match(op, val):
+            return False
+    return True
@@ -1,4 +1,4 @@
-from distutils.core import setup
+from setuptools import setup
 
 try:
     long_desc = open('./README.rst').read()
@@ -15,5 +15,8 @@ setup(
     license='MIT License',
     description='Django QuerySet inspired interface to query list of dicts',
     long_description=long_desc,
+    python_requires='>=3.7',
+    entry_points={
+        'console_scripts': ['lookupy = lookupy.cli:main'],
+    },
 )
-